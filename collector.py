@@ -0,0 +1,214 @@
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import hmac
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from db_writer import BatchedWriter
+from init_database import initialize_database
+from retention import run_retention, load_policy, ARCHIVE_DIR
+from replication import load_hub_config, get_cursor, KEYS, PUSH_COLUMNS, HUB_FILE
+
+# Constants
+FLEET_DIR = "fleet"  # One <node id>.db per node, with the same schema as sensor_data.db
+MAX_BODY = 8 * 1024 * 1024  # Largest accepted push after decompression (in bytes)
+NODE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+collector_logger = logging.getLogger('collector')
+
+
+class IngestError(Exception):
+    """A push that is rejected, with the HTTP status to answer it with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Collector:
+    """
+    Stores readings pushed by nodes in one database per node, so data_storage,
+    the dashboard API and export work on any node with db_path=collector.db_path(node).
+    :param fleet_dir: Directory of the per-node databases.
+    :param tokens: Dict of node id -> shared token the node authenticates with.
+    """
+
+    def __init__(self, fleet_dir=FLEET_DIR, tokens=None):
+        self.fleet_dir = fleet_dir
+        self.tokens = tokens or {}
+        self.writers = {}
+        self.lock = threading.Lock()
+        os.makedirs(fleet_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the "collector" section of hub.json, or return None if it has none."""
+        settings = config.get("collector")
+        if not settings:
+            return None
+        return cls(settings.get("fleet_dir", FLEET_DIR), settings.get("tokens"))
+
+    def db_path(self, node):
+        if not NODE_ID_PATTERN.match(node or ""):
+            raise IngestError(400, f"Invalid node id: {node!r}")
+        return os.path.join(self.fleet_dir, f"{node}.db")
+
+    def nodes(self):
+        """Node ids with a database in fleet_dir, sorted."""
+        return sorted(name[:-3] for name in os.listdir(self.fleet_dir) if name.endswith(".db"))
+
+    def _writer(self, node):
+        writer = self.writers.get(node)
+        if writer is None:
+            path = self.db_path(node)
+            initialize_database(path, quiet=True)
+            # Flushed explicitly, so one push is one transaction
+            writer = self.writers[node] = BatchedWriter(path, batch_size=sys.maxsize, flush_interval=float("inf"))
+        return writer
+
+    def ingest(self, token, body, encoding=None):
+        """
+        Store one push from replication.py.
+        Rows are only stored when they continue where the node's previous push
+        ended; rows the collector already holds are skipped. Pushes keyed by Unix
+        time continue after the newest stored reading, whatever the node's ids
+        were before it switched to the compact layout, and may go back to fill
+        in readings stored while the node's clock was behind.
+        :param token: Bearer token sent with the push.
+        :param body: Request body, gzip-compressed when encoding is 'gzip'.
+        :return: Dict with the node id and the last id acknowledged for it.
+        """
+        try:
+            if encoding == "gzip":
+                with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                    body = f.read(MAX_BODY + 1)
+            if len(body) > MAX_BODY:
+                raise IngestError(413, "Push too large")
+            payload = json.loads(body)
+            node, after, rows = payload["node"], int(payload["after"]), payload["rows"]
+            key = payload.get("key", "id")
+            if key not in KEYS:
+                raise IngestError(400, f"Unknown key: {key!r}")
+            if not isinstance(node, str):
+                raise IngestError(400, f"Node id must be a string: {node!r}")
+            if tuple(payload["columns"]) != PUSH_COLUMNS:
+                raise IngestError(400, f"Unexpected columns: {payload['columns']}")
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+            raise IngestError(400, f"Malformed push: {e}")
+
+        expected = self.tokens.get(node)
+        if expected is None or not hmac.compare_digest(str(token), expected):
+            raise IngestError(401, f"Unknown node or token: {node!r}")
+
+        with self.lock:
+            writer = self._writer(node)
+            if key == "time":
+                # Seconds already stored are dropped by the writer
+                last_id = writer.conn.execute("SELECT MAX(time) FROM readings").fetchone()[0] or 0
+                new_rows = rows
+            else:
+                last_id = get_cursor(writer.conn, node)
+                new_rows = [row for row in rows if row[0] > last_id]
+            if after > last_id:
+                # Rows between last_id and after were lost here; the node resends them
+                collector_logger.warning(f"Node {node} pushed after id {after}, but only id {last_id} is stored.")
+                return {"node": node, "acknowledged": last_id}
+            if new_rows:
+                try:
+                    for row in new_rows:
+                        writer.add(tuple(row[1:]))
+                    writer.add_rows("replication_state", [(node, max(last_id, new_rows[-1][0]), time.time())])
+                    writer.flush()
+                except Exception:
+                    # Discard the writer with the rows it kept buffered; the node resends them
+                    del self.writers[node]
+                    writer.conn.close()
+                    raise
+                # Up to the end of the push, also when it went back behind last_id
+                last_id = new_rows[-1][0]
+                collector_logger.info(f"Stored {len(new_rows)} readings from {node} up to id {last_id}.")
+        return {"node": node, "acknowledged": last_id}
+
+    def run_retention(self, archive_dir=ARCHIVE_DIR):
+        """
+        Apply the retention policy to every node database, archiving each node
+        in archive_dir/<node id>. A node that fails is logged and skipped.
+        :return: Dict of node id -> table -> rows deleted.
+        """
+        policy = load_policy()
+        results = {}
+        for node in self.nodes():
+            try:
+                results[node] = run_retention(self.db_path(node), policy, os.path.join(archive_dir, node))
+            except Exception as e:
+                collector_logger.error(f"Error applying retention policy to {node}: {e}")
+        return results
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers = {}
+
+
+def bearer_token(authorization):
+    """The token of an 'Authorization: Bearer <token>' header, or None."""
+    if authorization and authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):]
+    return None
+
+
+def serve(collector, port):
+    """
+    Stand-in collector: a plain-HTTP server that only accepts pushes, for tests
+    and for trying hub mode on one machine. web_server serves the same endpoint
+    over TLS together with the fleet dashboard.
+    """
+
+    class IngestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                if self.path != "/api/ingest":
+                    raise IngestError(404, "Not found")
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, result = 200, collector.ingest(bearer_token(self.headers.get("Authorization")),
+                                                       body, self.headers.get("Content-Encoding"))
+            except IngestError as e:
+                status, result = e.status, {"error": str(e)}
+            except Exception as e:
+                collector_logger.error(f"Error storing push: {e}")
+                status, result = 500, {"error": "Could not store the push"}
+            data = json.dumps(result).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            collector_logger.info(format % args)
+
+    server = ThreadingHTTPServer(("", port), IngestHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        collector.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Stand-in hub collector accepting pushes over plain HTTP")
+    parser.add_argument("--config", default=HUB_FILE, help="Hub configuration JSON file")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    collector = Collector.from_config(load_hub_config(args.config))
+    if collector is None:
+        parser.error(f"Add a \"collector\" section to {args.config}")
+    serve(collector, args.port)
@@ -0,0 +1,322 @@
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+import pytz
+from rollups import METRICS
+
+# Constants
+DB_PATH = "sensor_data.db"
+BATCH_ROWS = 5000  # Legacy rows converted per transaction
+BATCH_PAUSE = 0.05  # Pause between transactions so writers get the lock (in seconds)
+BUSY_TIMEOUT = 5000  # Wait this long for a writer to finish (in milliseconds)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMEZONE = pytz.timezone("Europe/Warsaw")
+LEGACY_TABLE = "sensor_readings_legacy"  # The text-timestamp table after the switch
+OFFSET_YEARS = (1970, 2100)  # UTC offset changes of TIMEZONE stored for inserts through the view
+OFFSET_STEP = 28 * 86400  # Offsets are compared this far apart; changes are further apart than that (in seconds)
+
+# Metrics are stored as round(value * scale) integers, e.g. 21.37 °C as 2137
+SCALES = {
+    "temperature": 100,
+    "humidity": 100,
+    "soil_moisture": 100,
+    "cpu_temperature": 1000,
+    "lux": 1000,
+}
+
+# Compact layout: the Unix time is the rowid, so rows are stored in time order and
+# range scans need no separate index. utc_offset (minutes east of UTC) keeps the
+# local wall-clock time of each reading without depending on the system timezone.
+CREATE_READINGS = f"""
+CREATE TABLE IF NOT EXISTS readings (
+    time INTEGER PRIMARY KEY,
+    utc_offset INTEGER NOT NULL,
+    {', '.join(f'{metric} INTEGER' for metric in METRICS)}
+);
+"""
+
+
+def metric_sql(metric):
+    """SQL expression giving the real value of a compact metric column."""
+    return f"{metric} / {SCALES[metric]}.0"
+
+
+# Read path for code written against sensor_readings: same columns, with the
+# Unix time as id and the local time rendered as text
+CREATE_VIEW = f"""
+CREATE VIEW sensor_readings AS
+SELECT time AS id,
+       datetime(time + 60 * utc_offset, 'unixepoch') AS timestamp,
+       {', '.join(f'{metric_sql(metric)} AS {metric}' for metric in METRICS)}
+FROM readings;
+"""
+
+# UTC offset of TIMEZONE from each change on, so the insert trigger needs no timezone rules
+CREATE_OFFSETS = """
+CREATE TABLE IF NOT EXISTS utc_offsets (
+    start INTEGER PRIMARY KEY,
+    utc_offset INTEGER NOT NULL
+);
+"""
+
+# Inserts through the view take Unix times (or none, for now), stored with the UTC
+# offset in effect at that time. Local text timestamps are ambiguous around DST
+# changes and are refused; writers convert them with to_compact.
+CREATE_TRIGGER = f"""
+CREATE TRIGGER sensor_readings_insert INSTEAD OF INSERT ON sensor_readings
+BEGIN
+    SELECT RAISE(ABORT, 'sensor_readings takes Unix times; convert local timestamps with compact_schema.to_compact')
+    WHERE typeof(NEW.timestamp) NOT IN ('integer', 'real', 'null');
+    INSERT INTO readings (time, utc_offset, {', '.join(METRICS)})
+    SELECT time,
+           COALESCE((SELECT utc_offset FROM utc_offsets WHERE start <= time ORDER BY start DESC LIMIT 1), 0),
+           {', '.join(f'CAST(round(NEW.{metric} * {SCALES[metric]}) AS INTEGER)' for metric in METRICS)}
+    FROM (SELECT COALESCE(CAST(NEW.timestamp AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)) AS time);
+END;
+"""
+
+schema_logger = logging.getLogger('compact_schema')
+
+
+def utc_offset(epoch):
+    """Minutes east of UTC of the local time at Unix time epoch."""
+    return int(datetime.fromtimestamp(epoch, TIMEZONE).utcoffset().total_seconds()) // 60
+
+
+def epoch_to_local(epoch):
+    """Local 'YYYY-MM-DD HH:MM:SS' text of a Unix time."""
+    return datetime.fromtimestamp(epoch, TIMEZONE).strftime(TIMESTAMP_FORMAT)
+
+
+def offset_changes(first_year=OFFSET_YEARS[0], last_year=OFFSET_YEARS[1]):
+    """
+    Rows for utc_offsets: (Unix time, UTC offset in minutes from then on), one per
+    change of TIMEZONE's offset, each found to the second by bisection.
+    """
+    epoch = int(datetime(first_year, 1, 1, tzinfo=pytz.utc).timestamp())
+    end = int(datetime(last_year + 1, 1, 1, tzinfo=pytz.utc).timestamp())
+    offset = utc_offset(epoch)
+    changes = [(epoch, offset)]
+    while epoch < end:
+        following = epoch + OFFSET_STEP
+        if utc_offset(following) != offset:
+            low, high = epoch, following
+            while high - low > 1:
+                middle = (low + high) // 2
+                if utc_offset(middle) == offset:
+                    low = middle
+                else:
+                    high = middle
+            offset = utc_offset(high)
+            changes.append((high, offset))
+        epoch = following
+    return changes
+
+
+def local_to_epoch(timestamp, after=None):
+    """
+    Unix time of a local 'YYYY-MM-DD HH:MM:SS' string or naive datetime.
+    In the hour repeated when DST ends the earlier instant is used, unless it is
+    not after `after` (the previous reading's Unix time). Times skipped when DST
+    starts are read as standard time.
+    :return: (Unix time, UTC offset in minutes)
+    """
+    local = timestamp if isinstance(timestamp, datetime) else datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    try:
+        aware = TIMEZONE.localize(local, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        aware = TIMEZONE.localize(local, is_dst=True)
+        if after is not None and aware.timestamp() <= after:
+            aware = TIMEZONE.localize(local, is_dst=False)
+    except pytz.NonExistentTimeError:
+        aware = TIMEZONE.localize(local, is_dst=False)
+    return int(aware.timestamp()), int(aware.utcoffset().total_seconds()) // 60
+
+
+def to_compact(row, after=None):
+    """
+    Convert a (timestamp, *METRICS) reading to a row of the readings table.
+    :param row: The timestamp is Unix time or local text; metrics may be None.
+    :param after: Unix time of the previous reading, see local_to_epoch.
+    """
+    timestamp, values = row[0], row[1:]
+    if isinstance(timestamp, (int, float)):
+        epoch = int(timestamp)
+        offset = utc_offset(epoch)
+    else:
+        epoch, offset = local_to_epoch(timestamp, after)
+    return (epoch, offset) + tuple(None if value is None else int(round(value * SCALES[metric]))
+                                   for metric, value in zip(METRICS, values))
+
+
+def is_compact(conn):
+    """True once compact_schema.py has replaced the sensor_readings table by the view."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'sensor_readings'").fetchone()
+    return row is not None and row[0] == "view"
+
+
+def _copy_batch(conn, last_id, after, batch_rows):
+    """
+    Convert up to batch_rows legacy rows after last_id into readings.
+    :return: (rows read, last id, Unix time of the last row)
+    """
+    rows = conn.execute(
+        f"SELECT id, timestamp, {', '.join(METRICS)} FROM sensor_readings WHERE id > ? ORDER BY id LIMIT ?",
+        (last_id, batch_rows),
+    ).fetchall()
+    compact = []
+    for row in rows:
+        if row[1] is None:
+            continue
+        converted = to_compact(row[1:], after)
+        after = converted[0]
+        compact.append(converted)
+    # Two legacy rows in the same second keep the first; the rollups already hold both
+    conn.executemany(
+        f"INSERT OR IGNORE INTO readings (time, utc_offset, {', '.join(METRICS)}) "
+        f"VALUES ({', '.join('?' for _ in range(len(METRICS) + 2))})",
+        compact,
+    )
+    if len(compact) < len(rows):
+        schema_logger.warning(f"Skipped {len(rows) - len(compact)} legacy rows without a timestamp.")
+    return len(rows), rows[-1][0] if rows else last_id, after
+
+
+def _install_view(conn):
+    """Create the sensor_readings view, its offset table and insert trigger, in the caller's transaction."""
+    conn.execute(CREATE_OFFSETS)
+    conn.execute("DELETE FROM utc_offsets")
+    conn.executemany("INSERT INTO utc_offsets (start, utc_offset) VALUES (?, ?)", offset_changes())
+    if not is_compact(conn):
+        conn.execute(CREATE_VIEW)
+    conn.execute("DROP TRIGGER IF EXISTS sensor_readings_insert")
+    conn.execute(CREATE_TRIGGER)
+
+
+def _convert_cursors(conn):
+    """
+    Move the replication cursors from legacy ids to the Unix time of the row they
+    point at, since ids become Unix times with the switch.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'replication_state'").fetchone() is None:
+        return
+    for peer, last_id in conn.execute("SELECT peer, last_id FROM replication_state").fetchall():
+        row = conn.execute(
+            "SELECT timestamp FROM sensor_readings WHERE id <= ? AND timestamp IS NOT NULL ORDER BY id DESC LIMIT 1",
+            (last_id,),
+        ).fetchone()
+        # In the hour repeated when DST ends this is the earlier instant, as on the
+        # collector, so at worst that hour is pushed again
+        epoch = local_to_epoch(row[0])[0] if row else 0
+        conn.execute("UPDATE replication_state SET last_id = ? WHERE peer = ?", (epoch, peer))
+        schema_logger.info(f"Replication cursor for {peer} moved from id {last_id} to {epoch}.")
+
+
+def migrate(db_path=DB_PATH, batch_rows=BATCH_ROWS, pause=BATCH_PAUSE):
+    """
+    Convert sensor_readings to the compact layout while the writers keep running.
+    Rows are copied in short transactions and the progress is stored, so an
+    interrupted run resumes. The last batch is copied in the same transaction that
+    renames the old table to sensor_readings_legacy and creates the view, so no
+    reading written meanwhile is lost. Replication cursors are converted in the
+    same transaction.
+    :return: Number of legacy rows copied by this run.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT / 1000, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+        if is_compact(conn):
+            return 0
+        conn.execute(CREATE_READINGS)
+        conn.execute("CREATE TABLE IF NOT EXISTS compact_progress (last_id INTEGER NOT NULL, last_time INTEGER)")
+        copied = 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                progress = conn.execute("SELECT last_id, last_time FROM compact_progress").fetchone()
+                last_id, after = progress if progress else (0, None)
+                count, last_id, after = _copy_batch(conn, last_id, after, batch_rows)
+                copied += count
+                done = count < batch_rows
+                if done:
+                    _convert_cursors(conn)
+                    conn.execute(f"ALTER TABLE sensor_readings RENAME TO {LEGACY_TABLE}")
+                    _install_view(conn)
+                    conn.execute("DROP TABLE compact_progress")
+                else:
+                    conn.execute("DELETE FROM compact_progress")
+                    conn.execute("INSERT INTO compact_progress VALUES (?, ?)", (last_id, after))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if done:
+                schema_logger.info(f"Switched sensor_readings to the compact layout after {copied} rows.")
+                return copied
+            schema_logger.info(f"Converted legacy rows up to id {last_id}.")
+            time.sleep(pause)
+    finally:
+        conn.close()
+
+
+def upgrade(db_path=DB_PATH):
+    """
+    Bring a database's layout up to date, called by init_database. A new, empty
+    sensor_readings table is replaced by the view directly, without a legacy
+    table. Compact databases get the current insert trigger, and an empty
+    sensor_readings_legacy left by earlier versions is dropped.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT / 1000, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not is_compact(conn):
+                if conn.execute("SELECT EXISTS (SELECT 1 FROM sensor_readings)").fetchone()[0]:
+                    conn.execute("COMMIT")  # Existing readings are converted with migrate()
+                    return
+                conn.execute(CREATE_READINGS)
+                conn.execute("DROP TABLE sensor_readings")
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = 'sensor_readings'")
+                _install_view(conn)
+                schema_logger.info("Created sensor_readings in the compact layout.")
+            else:
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'utc_offsets'").fetchone() is None:
+                    _install_view(conn)
+                legacy = conn.execute(f"SELECT 1 FROM sqlite_master WHERE name = '{LEGACY_TABLE}'").fetchone()
+                if legacy and not conn.execute(f"SELECT EXISTS (SELECT 1 FROM {LEGACY_TABLE})").fetchone()[0]:
+                    conn.execute(f"DROP TABLE {LEGACY_TABLE}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def drop_legacy(db_path=DB_PATH):
+    """Drop sensor_readings_legacy; retention.py returns its pages to the filesystem."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT / 1000)
+    try:
+        if not is_compact(conn):
+            raise RuntimeError("sensor_readings has not been converted yet")
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {LEGACY_TABLE}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Convert sensor_readings to integer epoch keys and scaled-integer metrics")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--batch", type=int, default=BATCH_ROWS, help="Legacy rows converted per transaction")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help="Drop sensor_readings_legacy once the conversion is done")
+    args = parser.parse_args()
+    migrate(args.db, args.batch)
+    if args.drop_legacy:
+        drop_legacy(args.db)
+        print(f"Dropped {LEGACY_TABLE}.")
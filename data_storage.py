@@ -1,28 +1,577 @@
+import time
 import sqlite3
+import inspect
+import functools
+import threading
+from collections import OrderedDict
 from datetime import datetime
+import numpy as np
+import metrics
+from rollups import METRICS, RESOLUTIONS, bucket_start
+from retention import load_policy, cutoff
+from compact_schema import is_compact, local_to_epoch, metric_sql
 
-# Function to fetch last 24 hours of data from the database
-def get_data_from_db():
-    conn = sqlite3.connect("sensor_data.db")
-    cursor = conn.cursor()
-    
-    # Fetch timestamp, temperature, humidity, soil moisture, CPU temperature, and lux from the database
-    cursor.execute("""
-        SELECT timestamp, temperature, humidity, soil_moisture, cpu_temperature, lux 
-        FROM sensor_readings 
-        ORDER BY timestamp DESC 
-        LIMIT 24
-    """)
-    
-    rows = cursor.fetchall()
-    conn.close()
+DB_PATH = "sensor_data.db"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+RAW_MAX_SPAN = 6 * 3600  # Ranges up to this long (in seconds) are served from raw rows
+MAX_POINTS = 1000  # Upper bound on points per series returned by query_range
+CHART_POINTS = 300  # Default number of points per dashboard chart series
+CACHE_SIZE = 128  # Maximum number of cached query results
+CACHE_CHECK_INTERVAL = 1.0  # Re-check the database version at most this often (in seconds)
+EXPORT_CHUNK_ROWS = 1000  # Rows per query when iterating over a whole window
+
+retention_policy = load_policy()
+
+query_latency = metrics.histogram("pigarden_db_query_seconds", "Duration of dashboard queries that missed the cache, by query")
+cache_lookups = metrics.counter("pigarden_query_cache_total", "Query cache lookups, by query and result")
+
+def _format_timestamp(value):
+    """Accept a datetime or a 'YYYY-MM-DD HH:MM:SS' string and return the stored text form."""
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+def parse_timestamp(value):
+    """
+    Validate a window bound from a caller: a datetime or a 'YYYY-MM-DD HH:MM:SS' string.
+    :return: The stored text form, zero-padded so it compares correctly as text.
+    :raises ValueError: If value is neither.
+    """
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    if not isinstance(value, str):
+        raise ValueError(f"Expected a 'YYYY-MM-DD HH:MM:SS' timestamp, got {value!r}")
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    except ValueError:
+        raise ValueError(f"Expected a 'YYYY-MM-DD HH:MM:SS' timestamp, got {value!r}") from None
+
+# Read connections are kept open per thread, so PRAGMA data_version can tell
+# whether any other connection has committed since the last check
+_local = threading.local()
+
+def _connection(db_path):
+    connections = _local.__dict__.setdefault('connections', {})
+    if db_path not in connections:
+        connections[db_path] = sqlite3.connect(db_path)
+    return connections[db_path]
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results. All entries for a database are dropped
+    when its data version changes, i.e. when any writer commits. PRAGMA data_version
+    is per connection, so each thread compares the versions its own connection saw.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, check_interval=CACHE_CHECK_INTERVAL):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.local = threading.local()  # versions: db_path -> (checked_at, data_version) per thread
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def validate(self, db_path):
+        """Drop the cached results of db_path if the database changed since the last check."""
+        now = time.monotonic()
+        versions = self.local.__dict__.setdefault('versions', {})
+        checked_at, version = versions.get(db_path, (None, None))
+        if checked_at is not None and now - checked_at < self.check_interval:
+            return
+        current = _connection(db_path).execute("PRAGMA data_version").fetchone()[0]
+        versions[db_path] = (now, current)
+        if version is not None and current != version:
+            self.invalidate(db_path)
+
+    def invalidate(self, db_path=None):
+        """Drop cached results for one database, or for all of them."""
+        with self.lock:
+            for key in [key for key in self.entries if db_path is None or key[0] == db_path]:
+                del self.entries[key]
+            self.invalidations += 1
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self.entries),
+        }
+
+query_cache = QueryCache()
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return _format_timestamp(value)
+
+def cached_query(func):
+    """
+    Serve repeated calls with the same arguments from query_cache until the
+    database changes. Cached results are shared, so callers must not modify them.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        db_path = bound.arguments['db_path']
+        query_cache.validate(db_path)
+        key = (db_path, func.__name__) + tuple(_freeze(value) for value in bound.arguments.values())
+        found, result = query_cache.get(key)
+        cache_lookups.inc(query=func.__name__, result="hit" if found else "miss")
+        if not found:
+            with query_latency.time(query=func.__name__):
+                result = func(*args, **kwargs)
+            query_cache.put(key, result)
+        return result
+
+    return wrapper
+
+def invalidate_cache(db_path=None):
+    """Called by BatchedWriter after each commit, so readers in the same process see it at once."""
+    query_cache.invalidate(db_path)
+
+def cache_stats():
+    """Hit, miss, eviction and invalidation counters of the query cache."""
+    return query_cache.stats()
+
+def _local_epoch(value):
+    return local_to_epoch(parse_timestamp(value))[0]
+
+def _time_key(conn):
+    """
+    Column and bound conversion for time windows on sensor_readings: the timestamp
+    text, or in the compact layout the id, which is the Unix time and the rowid.
+    """
+    if is_compact(conn):
+        return "id", _local_epoch
+    return "timestamp", parse_timestamp
+
+def _check_metrics(metrics):
+    metrics = list(metrics)
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+    return metrics
+
+@cached_query
+def query_readings(start=None, end=None, metrics=METRICS, limit=None, db_path=DB_PATH):
+    """
+    Fetch readings in a time window using the index on sensor_readings.timestamp,
+    or a rowid range scan in the compact layout.
+    :param start: Inclusive start of the window (datetime or timestamp string), or None.
+    :param end: Exclusive end of the window (datetime or timestamp string), or None.
+    :param metrics: Metric columns to return, a subset of METRICS.
+    :param limit: If set, return only the newest `limit` rows of the window.
+    :return: Dict of column name to list of values, oldest first, including 'timestamp'.
+    """
+    metrics = _check_metrics(metrics)
+    conn = _connection(db_path)
+    key, bound = _time_key(conn)
+
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append(f"{key} >= ?")
+        params.append(bound(start))
+    if end is not None:
+        conditions.append(f"{key} < ?")
+        params.append(bound(end))
+
+    sql = f"SELECT {', '.join(['timestamp'] + metrics)} FROM sensor_readings"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if limit is not None:
+        # Walk the index from the newest end and stop after `limit` rows
+        sql += f" ORDER BY {key} DESC LIMIT ?"
+        params.append(limit)
+    else:
+        sql += f" ORDER BY {key}"
+
+    rows = conn.execute(sql, params).fetchall()
+
+    if limit is not None:
+        rows.reverse()
+
+    columns = ['timestamp'] + metrics
+    return {column: [row[i] for row in rows] for i, column in enumerate(columns)}
+
+def iter_readings(start=None, end=None, metrics=METRICS, chunk_rows=EXPORT_CHUNK_ROWS, db_path=DB_PATH):
+    """
+    Iterate over every reading in a time window without loading it at once.
+    Each chunk is its own short query that continues after the last row of the
+    previous one, so memory stays constant and no read transaction is held open
+    while the caller consumes the rows.
+    :param start: Inclusive start of the window, or None.
+    :param end: Exclusive end of the window, or None.
+    :return: Generator of lists of (id, timestamp, *metrics) tuples, oldest first.
+    """
+    metrics = _check_metrics(metrics)
+    conn = _connection(db_path)
+    key, bound = _time_key(conn)
+
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append(f"{key} >= ?")
+        params.append(bound(start))
+    if end is not None:
+        conditions.append(f"{key} < ?")
+        params.append(bound(end))
+    # Timestamps are not unique in the legacy table, so the id breaks ties
+    order, position = ("id", lambda row: (row[0],)) if key == "id" else ("timestamp, id", lambda row: (row[1], row[0]))
+
+    last = None
+    while True:
+        where, args = list(conditions), list(params)
+        if last is not None:
+            # The plain bound on the key lets the index seek straight to the last row
+            where.append(f"{key} >= ? AND ({order}) > ({', '.join('?' for _ in last)})")
+            args.extend((last[0],) + last)
+        sql = f"SELECT {', '.join(['id', 'timestamp'] + metrics)} FROM sensor_readings"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        rows = conn.execute(sql, args + [chunk_rows]).fetchall()
+        if rows:
+            yield rows
+        if len(rows) < chunk_rows:
+            return
+        last = position(rows[-1])
+
+@cached_query
+def query_rollups(resolution, start, end, metrics=METRICS, db_path=DB_PATH):
+    """
+    Fetch pre-aggregated buckets from a rollup table.
+    :param resolution: 'minute', 'hour' or 'day'.
+    :param start: Start of the window; the bucket containing it is included.
+    :param end: Exclusive end of the window.
+    :param metrics: Metrics to return, a subset of METRICS.
+    :return: Dict with 'timestamp' (bucket starts) and, per metric, the mean under
+             the metric name plus '<metric>_min', '<metric>_max' and '<metric>_count'.
+             Buckets without data for a metric hold None.
+    """
+    metrics = _check_metrics(metrics)
+    table = RESOLUTIONS[resolution][0]
+    rows = _connection(db_path).execute(
+        f"""
+        SELECT bucket, metric, min, max, sum, count FROM {table}
+        WHERE bucket >= ? AND bucket < ? AND metric IN ({', '.join('?' for _ in metrics)})
+        ORDER BY bucket
+        """,
+        [bucket_start(parse_timestamp(start), resolution), parse_timestamp(end)] + metrics,
+    ).fetchall()
+
+    buckets = sorted({row[0] for row in rows})
+    index = {bucket: i for i, bucket in enumerate(buckets)}
+    data = {'timestamp': buckets}
+    for metric in metrics:
+        for suffix in ("", "_min", "_max", "_count"):
+            data[metric + suffix] = [None] * len(buckets)
+    for bucket, metric, low, high, total, count in rows:
+        i = index[bucket]
+        data[metric][i] = total / count if count else None
+        data[metric + "_min"][i] = low
+        data[metric + "_max"][i] = high
+        data[metric + "_count"][i] = count
+    return data
+
+def _retained(table, start):
+    """False if retention has already expired the table's rows at start."""
+    days = retention_policy.get(table)
+    return days is None or start >= cutoff(days)[0]
+
+def choose_resolution(start, end, max_points=MAX_POINTS):
+    """
+    Pick the source for a window: 'raw' for short ranges, otherwise the finest
+    rollup that fits in max_points buckets, falling back to 'day'. Sources whose
+    rows at start have been expired by retention.py are skipped.
+    """
+    start_text = parse_timestamp(start)
+    start = datetime.strptime(start_text, TIMESTAMP_FORMAT)
+    end = datetime.strptime(parse_timestamp(end), TIMESTAMP_FORMAT)
+    span = (end - start).total_seconds()
+    if span <= RAW_MAX_SPAN and _retained("sensor_readings", start_text):
+        return "raw"
+    for resolution, (table, _, seconds) in RESOLUTIONS.items():
+        if span / seconds <= max_points and _retained(table, start_text):
+            return resolution
+    return "day"
+
+def query_range(start, end, metrics=METRICS, max_points=MAX_POINTS, db_path=DB_PATH):
+    """
+    Fetch a window at the resolution chosen by choose_resolution, so long ranges
+    are served from rollups instead of scanning raw rows.
+    :return: Same columnar dict as query_readings or query_rollups, plus 'resolution'.
+    """
+    resolution = choose_resolution(start, end, max_points)
+    if resolution == "raw":
+        data = query_readings(start, end, metrics, db_path=db_path)
+    else:
+        data = query_rollups(resolution, start, end, metrics, db_path=db_path)
+    return dict(data, resolution=resolution)
+
+def downsample_lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets: pick `threshold` points that keep the visual
+    shape of a series, including isolated peaks and drops.
+    :param xs: Numeric x values, ascending.
+    :param ys: Numeric y values (no None).
+    :param threshold: Number of points to keep.
+    :return: Ascending list of selected indices.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third corner of the triangle
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(ys[avg_start:avg_end]) / (avg_end - avg_start)
+
+        # Keep the point of the current bucket with the largest triangle
+        max_area = -1.0
+        next_a = a
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        selected.append(next_a)
+        a = next_a
+    selected.append(n - 1)
+    return selected
+
+def downsample_minmax(xs, ys, threshold):
+    """
+    Keep the minimum and maximum of `threshold // 2` equal-count buckets, so every
+    extreme of the series survives.
+    :return: Ascending list of selected indices.
+    """
+    n = len(ys)
+    if threshold >= n:
+        return list(range(n))
+    buckets = max(1, threshold // 2)
+    selected = []
+    for b in range(buckets):
+        low, high = b * n // buckets, (b + 1) * n // buckets
+        if low >= high:
+            continue
+        bucket = range(low, high)
+        selected.extend(sorted({min(bucket, key=ys.__getitem__), max(bucket, key=ys.__getitem__)}))
+    return selected
+
+DOWNSAMPLERS = {"lttb": downsample_lttb, "minmax": downsample_minmax}
+
+@cached_query
+def get_chart_series(start=None, end=None, points=CHART_POINTS, limit=24, method="lttb", db_path=DB_PATH):
+    """
+    Build per-metric chart series reduced to at most `points` points each.
+    Without a window the newest `limit` readings are used, as on the default dashboard.
+    :return: Dict of metric to {'labels': [...], 'values': [...]}, oldest first.
+    """
+    if start is not None and end is not None:
+        data = query_range(start, end, db_path=db_path)
+    else:
+        data = query_readings(start, end, limit=limit, db_path=db_path)
+
+    columns = SensorSeries.from_columns(data)
+    times = columns.times
+    multi_day = len(times) > 1 and times[-1] - times[0] > 86400
+
+    series = {}
+    for metric in METRICS:
+        values = columns.values[metric]
+        present = np.flatnonzero(~np.isnan(values))
+        ys = values[present].tolist()
+        keep = np.asarray(DOWNSAMPLERS[method](times[present].tolist(), ys, points), dtype=np.int64)
+        # ISO minutes, 'YYYY-MM-DDTHH:MM', only for the points that are kept
+        stamps = times[present[keep]].astype('datetime64[s]').astype('datetime64[m]').astype(str)
+        series[metric] = {
+            'labels': [f"{ts[5:10]} {ts[11:]}" if multi_day else ts[11:] for ts in stamps],
+            'values': [ys[i] for i in keep],
+        }
+    return series
+
+@cached_query
+def get_latest_row(db_path=DB_PATH):
+    """
+    Return the newest reading as a dict with 'id', 'timestamp' and every metric,
+    or None for an empty table. The id (the Unix time in the compact layout)
+    doubles as a version of the whole table.
+    """
+    row = _connection(db_path).execute(
+        f"SELECT id, timestamp, {', '.join(METRICS)} FROM sensor_readings ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('id', 'timestamp') + METRICS, row))
+
+def _to_epoch(value):
+    """Epoch seconds of a datetime, timestamp string or number, on the SensorSeries time scale."""
+    if isinstance(value, (datetime, str)):
+        return int(np.datetime64(_format_timestamp(value), 's').astype(np.int64))
+    return int(value)
+
+class SensorSeries:
+    """
+    Columnar time series backed by NumPy arrays.
+    `times` holds int64 epoch seconds of the stored timestamps (read as wall-clock
+    time, so no timezone conversion happens), ascending. `values` maps each metric
+    to a float64 array with NaN for missing readings.
+    """
+
+    def __init__(self, times, values):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.values = {metric: np.asarray(column, dtype=np.float64) for metric, column in values.items()}
+
+    @classmethod
+    def from_columns(cls, data):
+        """Build a series from a columnar dict as returned by query_readings or query_rollups."""
+        times = np.array(data['timestamp'], dtype='datetime64[s]').astype(np.int64)
+        return cls(times, {metric: np.array(data[metric], dtype=np.float64) for metric in METRICS if metric in data})
+
+    @classmethod
+    def from_db(cls, start=None, end=None, metrics=METRICS, db_path=DB_PATH):
+        """
+        Bulk-load raw readings; SQLite converts the timestamps, so no row is parsed in Python.
+        The compact layout is read directly, without any timestamp text at all.
+        :param start: Inclusive start of the window, or None.
+        :param end: Exclusive end of the window, or None.
+        """
+        metrics = _check_metrics(metrics)
+        conn = _connection(db_path)
+        if is_compact(conn):
+            key, bound = "time", _local_epoch
+            sql = f"SELECT time + 60 * utc_offset, {', '.join(metric_sql(metric) for metric in metrics)} FROM readings"
+        else:
+            key, bound = "timestamp", parse_timestamp
+            sql = f"SELECT CAST(strftime('%s', timestamp) AS INTEGER), {', '.join(metrics)} FROM sensor_readings"
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append(f"{key} >= ?")
+            params.append(bound(start))
+        if end is not None:
+            conditions.append(f"{key} < ?")
+            params.append(bound(end))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {key}"
+
+        rows = conn.execute(sql, params).fetchall()
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), len(metrics) + 1)  # None -> NaN
+        return cls(table[:, 0], {metric: table[:, i + 1] for i, metric in enumerate(metrics)})
+
+    def __len__(self):
+        return len(self.times)
+
+    def slice(self, start=None, end=None):
+        """Return the samples with start <= time < end (datetimes, strings or epoch seconds)."""
+        low = 0 if start is None else np.searchsorted(self.times, _to_epoch(start), side="left")
+        high = len(self.times) if end is None else np.searchsorted(self.times, _to_epoch(end), side="left")
+        return SensorSeries(self.times[low:high], {metric: column[low:high] for metric, column in self.values.items()})
+
+    def resample(self, interval, how="mean"):
+        """
+        Aggregate into fixed buckets of `interval` seconds, ignoring NaN.
+        :param how: 'mean', 'min', 'max' or 'count'.
+        :return: New series stamped with the bucket starts; empty buckets are not emitted.
+        """
+        if len(self.times) == 0:
+            return SensorSeries(self.times, self.values)
+        buckets = self.times // interval * interval
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        values = {}
+        for metric, column in self.values.items():
+            present = ~np.isnan(column)
+            counts = np.add.reduceat(present.astype(np.int64), starts)
+            if how == "mean":
+                sums = np.add.reduceat(np.where(present, column, 0.0), starts)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    values[metric] = np.where(counts > 0, sums / counts, np.nan)
+            elif how == "min":
+                values[metric] = np.fmin.reduceat(column, starts)
+            elif how == "max":
+                values[metric] = np.fmax.reduceat(column, starts)
+            elif how == "count":
+                values[metric] = counts.astype(np.float64)
+            else:
+                raise ValueError(f"Unknown aggregation: {how}")
+        return SensorSeries(buckets[starts], values)
+
+    def rolling(self, metric, window, how="mean"):
+        """
+        Rolling statistic over the last `window` samples, ignoring NaN.
+        :param how: 'mean', 'std', 'min' or 'max'.
+        :return: float64 array aligned with `times`; the first window - 1 entries are NaN.
+        """
+        column = self.values[metric]
+        result = np.full(len(column), np.nan)
+        if window < 1 or len(column) < window:
+            return result
+
+        if how in ("mean", "std"):
+            present = ~np.isnan(column)
+            filled = np.where(present, column, 0.0)
+            counts = np.convolve(present.astype(np.float64), np.ones(window), "valid")
+            sums = np.convolve(filled, np.ones(window), "valid")
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.where(counts > 0, sums / counts, np.nan)
+                if how == "mean":
+                    result[window - 1:] = mean
+                else:
+                    squares = np.convolve(filled * filled, np.ones(window), "valid")
+                    result[window - 1:] = np.sqrt(np.maximum(squares / counts - mean * mean, 0.0))
+        elif how in ("min", "max"):
+            windows = np.lib.stride_tricks.sliding_window_view(column, window)
+            result[window - 1:] = (np.fmin if how == "min" else np.fmax).reduce(windows, axis=1)
+        else:
+            raise ValueError(f"Unknown rolling statistic: {how}")
+        return result
+
+    def to_columns(self):
+        """Columnar dict of Python lists (None for NaN) in the query_readings layout."""
+        stamps = self.times.astype('datetime64[s]').astype(str)
+        data = {'timestamp': [ts.replace("T", " ") for ts in stamps]}
+        for metric, column in self.values.items():
+            data[metric] = np.where(np.isnan(column), None, column).tolist()
+        return data
+
+# Function to fetch the latest readings for the dashboard, oldest first
+def get_data_from_db(start=None, end=None, limit=24):
+    data = query_readings(start, end, limit=limit)
 
     # Parse and format the data
-    timestamps = [datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").strftime("%H:%M") for row in rows]
-    temperatures = [row[1] for row in rows]
-    humidities = [row[2] for row in rows]
-    soil_moistures = [row[3] for row in rows]
-    cpu_temperatures = [row[4] for row in rows]
-    lux_values = [row[5] for row in rows]  # Extract lux values
-
-    return timestamps, temperatures, humidities, soil_moistures, cpu_temperatures, lux_values
+    timestamps = [datetime.strptime(ts, TIMESTAMP_FORMAT).strftime("%H:%M") for ts in data['timestamp']]
+
+    return (timestamps, data['temperature'], data['humidity'], data['soil_moisture'],
+            data['cpu_temperature'], data['lux'])
@@ -1,18 +1,37 @@
 import os
+import sys
+import math
 import time
+import signal
+import threading
 from datetime import datetime
-import sqlite3
 import pytz
 import logging
-from sensor_utils import (
-    read_soil_moisture,
-    get_cpu_temperature,
-    read_temperature_humidity,
-    read_lux,
-)
+from sensor_client import get_snapshot
+from db_writer import BatchedWriter
+from sample_buffer import SampleRing
+from state_registry import get_registry
+from rollups import METRICS
+from retention import run_retention
+from replication import load_hub_config, replication_loop
+from collector import Collector
+from compact_schema import local_to_epoch
+import metrics
 
 # Constants
-SLEEP_INTERVAL = 3600  # Interval to push data to the database (in seconds)
+SAMPLE_PERIOD = 1  # Read a sensor snapshot this often (in seconds)
+AGGREGATE_INTERVAL = 3600  # Persist min/max/mean/last/count per metric for each interval (in seconds)
+RING_CAPACITY = 2 * AGGREGATE_INTERVAL // SAMPLE_PERIOD  # Samples kept in memory
+SNAPSHOT_MAX_AGE = 60  # Ignore sensor snapshots older than this (in seconds)
+EVENT_BEFORE = 60  # Raw samples stored before a detected event (in seconds)
+EVENT_AFTER = 300  # Raw samples stored after a detected event (in seconds)
+EVENT_JUMPS = {'soil_moisture': 2.0, 'temperature': 1.0, 'humidity': 5.0}  # Sample-to-sample change counted as an event
+LUX_EVENT_RATIO = 4.0  # A lux change by this factor either way is an event...
+LUX_EVENT_FLOOR = 10.0  # ...once either reading is above this
+EVENT_STATES = ("light", "pump")  # Registry states whose changes are events
+RETENTION_INTERVAL = 86400  # Expire and archive old rows this often (in seconds)
+RETENTION_DELAY = 300  # First retention run after startup (in seconds)
+TIMEZONE = pytz.timezone("Europe/Warsaw")
 
 # Set up logging
 log_dir = "logs"
@@ -28,38 +47,220 @@ file_handler = logging.FileHandler(log_file)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logger.addHandler(file_handler)
 
-# Function to push data into the database
-def push_data():
+samples_taken = metrics.counter("pigarden_samples_total", "Sensor snapshots sampled into the ring buffer")
+samples_missed = metrics.counter("pigarden_samples_missed_total", "Sample ticks without a new snapshot from the sensor service")
+events_detected = metrics.counter("pigarden_events_total", "Detected events, by kind")
+persist_latency = metrics.histogram("pigarden_persist_seconds", "Duration of aggregating and buffering one interval")
+retention_latency = metrics.histogram("pigarden_retention_seconds", "Duration of a retention run",
+                                      buckets=(1, 5, 15, 60, 300, 900, 3600))
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
+
+
+def local_time(timestamp):
+    return datetime.fromtimestamp(timestamp, TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class EventDetector:
+    """
+    Flags samples where something happened: the lamp or a pump switched, or a
+    reading jumped by more than EVENT_JUMPS (LUX_EVENT_RATIO for lux) since the previous sample.
+    """
+
+    def __init__(self):
+        self.previous = None
+        self.states = {}
+
+    def check(self, sample):
+        """:return: List of (kind, detail) for the events in this sample."""
+        events = []
+        registry = get_registry()
+        for name in EVENT_STATES:
+            state = registry.get_state(name)
+            if name in self.states and state != self.states[name]:
+                events.append((name, f"{self.states[name]} -> {state}"))
+            self.states[name] = state
+
+        if self.previous is not None:
+            for metric, jump in EVENT_JUMPS.items():
+                before, after = self.previous.get(metric), sample.get(metric)
+                if before is not None and after is not None and abs(after - before) >= jump:
+                    events.append((metric, f"{before} -> {after}"))
+            before, after = self.previous.get('lux'), sample.get('lux')
+            if (before is not None and after is not None and max(before, after) > LUX_EVENT_FLOOR
+                    and max(before, after) >= LUX_EVENT_RATIO * max(min(before, after), 1.0)):
+                events.append(('lux', f"{before} -> {after}"))
+        self.previous = sample
+        return events
+
+
+def store_reading(writer, bucket, end, interval=AGGREGATE_INTERVAL):
+    """
+    Store the sensor_readings row of one interval from its merged sensor_aggregates
+    rows, so samples from before a restart are included, stamped with the
+    interval's last second.
+    :param bucket: Local start of the interval, as in sensor_aggregates.
+    :param end: Unix time the interval ends at.
+    :return: False if the interval has no aggregates.
+    """
+    with writer.lock:
+        means = dict(writer.conn.execute(
+            "SELECT metric, mean FROM sensor_aggregates WHERE bucket = ? AND seconds = ?", (bucket, interval)))
+    if not means:
+        return False
+    writer.add((int(end) - 1,) + tuple(means.get(metric) for metric in METRICS))
+    return True
+
+
+def store_missing_readings(writer, before, interval=AGGREGATE_INTERVAL):
+    """
+    Store the readings of intervals that have aggregates but no reading yet,
+    left by a run stopped before its interval ended.
+    :param before: Unix time of the current interval's start; it is not stored yet.
+    """
+    with writer.lock:
+        newest = writer.conn.execute("SELECT timestamp FROM sensor_readings ORDER BY id DESC LIMIT 1").fetchone()
+        newest = newest[0] if newest else ""
+        buckets = [bucket for bucket, in writer.conn.execute(
+            "SELECT DISTINCT bucket FROM sensor_aggregates WHERE seconds = ? AND bucket > ? AND bucket < ? ORDER BY bucket",
+            (interval, newest, local_time(before)))]
+    after = local_to_epoch(newest)[0] if newest else None
+    for bucket in buckets:
+        start = after = local_to_epoch(bucket, after)[0]
+        store_reading(writer, bucket, start + interval, interval)
+        logger.info(f"Stored the reading of the interval since {bucket} from its aggregates.")
+
+
+def persist_interval(writer, ring, start, end, interval=AGGREGATE_INTERVAL, reading=True):
+    """
+    Write the aggregates of [start, end), merged with those of an earlier run in
+    the same interval, then the interval's sensor_readings row (see store_reading).
+    :param reading: False for a partial interval on shutdown: the reading is stored
+                    when the interval ends, or after a restart in a later interval
+                    by store_missing_readings.
+    """
+    bucket = local_time(start)
+    times, _ = ring.window(start, end)
+    if len(times):
+        aggregates = ring.aggregate(start, end)
+        writer.add_rows("sensor_aggregates", [
+            (bucket, metric, interval, a['min'], a['max'], a['mean'], a['last'], a['count'])
+            for metric, a in aggregates.items()
+        ])
+        missing = [metric for metric, a in aggregates.items() if a['count'] == 0]
+        if missing:
+            logger.warning(f"No {', '.join(missing)} readings since {bucket}; storing NULL for them.")
+        logger.info(f"Aggregated {len(times)} samples since {bucket}: "
+                    + ", ".join(f"{metric} {aggregates[metric]['mean']}" for metric in METRICS))
+    if not reading:
+        return
+    writer.flush()  # Merge the aggregates before the reading is built from them
+    if not store_reading(writer, bucket, end, interval):
+        logger.warning(f"No samples between {bucket} and {local_time(end)}.")
+
+
+# Function to sample the sensor service and push aggregates into the database
+def push_data(writer, sample_period=SAMPLE_PERIOD, interval=AGGREGATE_INTERVAL):
+    ring = SampleRing(max(RING_CAPACITY, int((interval + EVENT_BEFORE) / sample_period)))
+    detector = EventDetector()
+    last_timestamp = 0.0
+    raw_until = 0.0  # Samples up to this time are stored raw
+    bucket_start = time.time() // interval * interval
+    next_sample = time.monotonic()
+    try:
+        store_missing_readings(writer, bucket_start, interval)
+    except Exception as e:
+        errors.inc(component="data_update")
+        logger.error(f"Error storing readings of earlier intervals: {e}")
+    try:
+        while True:
+            try:
+                snapshot = get_snapshot(max_age=SNAPSHOT_MAX_AGE)
+                if snapshot is None or snapshot['timestamp'] <= last_timestamp:
+                    samples_missed.inc()
+                else:
+                    samples_taken.inc()
+                    timestamp = last_timestamp = snapshot['timestamp']
+                    sample = {metric: snapshot.get(metric) for metric in METRICS}
+                    ring.append(timestamp, sample)
+
+                    events = detector.check(sample)
+                    if events:
+                        for kind, _ in events:
+                            events_detected.inc(kind=kind)
+                        writer.add_rows("sensor_events", [(local_time(timestamp), kind, detail)
+                                                          for kind, detail in events])
+                        logger.info(f"Events at {local_time(timestamp)}: "
+                                    + "; ".join(f"{kind} {detail}" for kind, detail in events))
+                        # Store the samples leading up to the event, then keep storing for EVENT_AFTER
+                        times, values = ring.window(max(timestamp - EVENT_BEFORE, raw_until), timestamp)
+                        writer.add_rows("sensor_raw_samples", [
+                            (float(t),) + tuple(None if math.isnan(v) else float(v) for v in row)
+                            for t, row in zip(times, values)
+                        ])
+                        raw_until = timestamp + EVENT_AFTER
+                    if timestamp <= raw_until:
+                        writer.add_rows("sensor_raw_samples",
+                                        [(timestamp,) + tuple(sample[metric] for metric in METRICS)])
+            except Exception as e:
+                # Log any errors that occur
+                errors.inc(component="data_update")
+                logger.error(f"Error occurred: {e}")
+
+            now = time.time()
+            if now >= bucket_start + interval:
+                try:
+                    with persist_latency.time():
+                        persist_interval(writer, ring, bucket_start, bucket_start + interval, interval)
+                except Exception as e:
+                    errors.inc(component="data_update")
+                    logger.error(f"Error persisting aggregates: {e}")
+                bucket_start = now // interval * interval
+
+            next_sample += sample_period
+            time.sleep(max(0.0, next_sample - time.monotonic()))  # Wait before the next sample
+    finally:
+        # Keep the partial interval; a restart merges into the same aggregate rows
+        persist_interval(writer, ring, bucket_start, bucket_start + interval, interval, reading=False)
+
+
+def retention_loop(collector=None):
+    """
+    Apply the retention policy daily; it works in small transactions next to the writer.
+    :param collector: On a hub, the Collector whose node databases are expired too.
+    """
+    time.sleep(RETENTION_DELAY)
     while True:
         try:
-            time.sleep(10) #sleep 10 s to let sensor wake up
-            soil_moisture = read_soil_moisture(0)  # Using channel 0 for soil moisture
-            cTemp, humidity = read_temperature_humidity()
-            cpu_temperature = get_cpu_temperature()
-            lux = read_lux()
-            local_time = datetime.now(pytz.timezone("Europe/Warsaw")).strftime("%Y-%m-%d %H:%M:%S")
-            # Store data in the database
-            conn = sqlite3.connect("sensor_data.db")
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO sensor_readings (timestamp, temperature, humidity, soil_moisture, cpu_temperature, lux)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (local_time, cTemp, humidity, soil_moisture, cpu_temperature, lux),
-            )
-            conn.commit()
-            conn.close()
-
-            # Log the data update
-            logger.info(f"Data logged at {local_time}:")
-            logger.info(f"  Temperature: {cTemp}°C, Humidity: {humidity}%, Soil Moisture: {soil_moisture}%, CPU Temp: {cpu_temperature}°C, Lux: {lux} lx")
-
+            with retention_latency.time():
+                expired = run_retention()
+                if collector is not None:
+                    expired["fleet"] = collector.run_retention()
+            logger.info(f"Retention run expired: {expired}")
         except Exception as e:
-            # Log any errors that occur
-            logger.error(f"Error occurred: {e}")
+            errors.inc(component="retention")
+            logger.error(f"Error applying retention policy: {e}")
+        time.sleep(RETENTION_INTERVAL)
 
-        time.sleep(SLEEP_INTERVAL)  # Wait before the next update
 
 if __name__ == "__main__":
-    push_data()
+    writer = BatchedWriter()
+    metrics.serve_metrics("data_update")
+    hub = load_hub_config()
+    threading.Thread(target=retention_loop, args=(Collector.from_config(hub),), daemon=True).start()
+    if hub["collector_url"] and hub["node_id"]:
+        # Hub mode: push new readings to the central collector
+        threading.Thread(target=replication_loop, args=(hub,), daemon=True).start()
+
+    def signal_handler(sig, frame):
+        """Turn SIGTERM into a normal exit so buffered readings get flushed."""
+        logger.info("Process terminated. Flushing buffered readings.")
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    try:
+        push_data(writer)
+    except KeyboardInterrupt:
+        logger.info("Script interrupted. Flushing buffered readings.")
+    finally:
+        writer.close()
@@ -0,0 +1,193 @@
+import time
+import sqlite3
+import logging
+import threading
+import metrics
+from rollups import METRICS, update_rollups
+from compact_schema import epoch_to_local, is_compact, to_compact
+from data_storage import invalidate_cache
+
+# Constants
+DB_PATH = "sensor_data.db"
+BATCH_SIZE = 50  # Flush once this many readings are buffered
+FLUSH_INTERVAL = 60  # Flush buffered readings at least this often (in seconds)
+SYNCHRONOUS = "NORMAL"  # With WAL, NORMAL only syncs at checkpoints
+
+READING_COLUMNS = ("timestamp", "temperature", "humidity", "soil_moisture", "cpu_temperature", "lux")
+# Other tables written through the same batches, with the statement used for each
+SIDE_TABLES = {
+    # A restarted data_update merges into the aggregates of the interval it was stopped in
+    "sensor_aggregates": """
+        INSERT INTO sensor_aggregates (bucket, metric, seconds, min, max, mean, last, count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(bucket, metric) DO UPDATE SET
+            min = COALESCE(MIN(sensor_aggregates.min, excluded.min), sensor_aggregates.min, excluded.min),
+            max = COALESCE(MAX(sensor_aggregates.max, excluded.max), sensor_aggregates.max, excluded.max),
+            mean = CASE WHEN sensor_aggregates.count + excluded.count = 0 THEN NULL ELSE
+                (COALESCE(sensor_aggregates.mean, 0) * sensor_aggregates.count
+                 + COALESCE(excluded.mean, 0) * excluded.count) / (sensor_aggregates.count + excluded.count) END,
+            last = COALESCE(excluded.last, sensor_aggregates.last),
+            count = sensor_aggregates.count + excluded.count
+    """,
+    "sensor_events": "INSERT INTO sensor_events (timestamp, kind, detail) VALUES (?, ?, ?)",
+    # A collector moves a node's cursor in the same transaction as the node's rows
+    "replication_state": """
+        INSERT INTO replication_state (peer, last_id, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(peer) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+    """,
+    # Raw windows around events may overlap; each sample is stored once
+    "sensor_raw_samples": (
+        f"INSERT OR IGNORE INTO sensor_raw_samples (time, {', '.join(READING_COLUMNS[1:])}) "
+        f"VALUES ({', '.join('?' for _ in READING_COLUMNS)})"
+    ),
+}
+
+writer_logger = logging.getLogger('data_update')
+
+write_latency = metrics.histogram("pigarden_db_write_seconds", "Duration of batched write transactions, including rollups")
+rows_written = metrics.counter("pigarden_db_rows_written_total", "Rows committed by the batched writer, by table")
+pending_rows = metrics.gauge("pigarden_db_pending_rows", "Rows buffered by the batched writer")
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
+
+
+class BatchedWriter:
+    """
+    Buffers sensor readings in memory and writes them to sensor_readings in
+    batches over one persistent WAL-mode connection. Once the database has been
+    converted by compact_schema.py, readings go straight to the readings table.
+    :param db_path: Path to the SQLite database.
+    :param batch_size: Number of buffered rows that triggers a flush.
+    :param flush_interval: Seconds after the last flush that trigger a flush.
+    :param synchronous: SQLite `synchronous` level for the connection.
+    :param maintain_rollups: Fold each flushed batch into the rollup tables.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 synchronous=SYNCHRONOUS, maintain_rollups=True):
+        self.batch_size = batch_size
+        self.maintain_rollups = maintain_rollups
+        self.flush_interval = flush_interval
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.buffer = []
+        self.side_buffers = {table: [] for table in SIDE_TABLES}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.insert_sql = (
+            f"INSERT INTO sensor_readings ({', '.join(READING_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in READING_COLUMNS)})"
+        )
+        self.compact_insert_sql = (
+            f"INSERT INTO readings (time, utc_offset, {', '.join(METRICS)}) "
+            f"VALUES ({', '.join('?' for _ in range(len(METRICS) + 2))})"
+        )
+
+    def add(self, row):
+        """
+        Buffer one reading and flush if a size or time threshold is reached.
+        :param row: Tuple of values in READING_COLUMNS order; the timestamp is
+                    Unix time or a local 'YYYY-MM-DD HH:MM:SS' string.
+        """
+        with self.lock:
+            self.buffer.append(row)
+        pending_rows.set(self.pending())
+        if self.flush_due():
+            self.flush()
+
+    def add_rows(self, table, rows):
+        """
+        Buffer rows for one of SIDE_TABLES; they are written in the same transactions as readings.
+        :param rows: Tuples of values in that table's column order.
+        """
+        with self.lock:
+            self.side_buffers[table].extend(rows)
+        pending_rows.set(self.pending())
+        if self.flush_due():
+            self.flush()
+
+    def pending(self):
+        return len(self.buffer) + sum(len(rows) for rows in self.side_buffers.values())
+
+    def flush_due(self):
+        return (self.pending() >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval)
+
+    def flush(self):
+        """Write all buffered rows in one transaction. Returns the number of rows written."""
+        with self.lock:
+            rows, self.buffer = self.buffer, []
+            side, self.side_buffers = self.side_buffers, {table: [] for table in SIDE_TABLES}
+            self.last_flush = time.monotonic()
+            written = len(rows) + sum(len(side_rows) for side_rows in side.values())
+            if not written:
+                return 0
+            started = time.perf_counter()
+            try:
+                with self.conn:
+                    # Take the write lock first, so the layout cannot be switched under this batch
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    if rows:
+                        if is_compact(self.conn):
+                            self._insert_compact(rows)
+                        else:
+                            self._insert_legacy(rows)
+                    for table, side_rows in side.items():
+                        if side_rows:
+                            self.conn.executemany(SIDE_TABLES[table], side_rows)
+            except BaseException:
+                # Keep the rows for the next attempt, including a flush on shutdown
+                self.buffer = rows + self.buffer
+                for table, side_rows in side.items():
+                    self.side_buffers[table] = side_rows + self.side_buffers[table]
+                errors.inc(component="db_writer")
+                pending_rows.set(self.pending())
+                raise
+            write_latency.observe(time.perf_counter() - started)
+            # Readers in this process skip the version check interval
+            invalidate_cache(self.db_path)
+            for table, table_rows in [("sensor_readings", rows)] + list(side.items()):
+                if table_rows:
+                    rows_written.inc(len(table_rows), table=table)
+            pending_rows.set(self.pending())
+        return written
+
+    def _insert_legacy(self, rows):
+        rows = [(epoch_to_local(row[0]),) + tuple(row[1:]) if isinstance(row[0], (int, float)) else row
+                for row in rows]
+        self.conn.executemany(self.insert_sql, rows)
+        if self.maintain_rollups:
+            # One executemany inside the write lock assigns consecutive ids
+            last_id = self.conn.execute("SELECT MAX(id) FROM sensor_readings").fetchone()[0]
+            update_rollups(self.conn, last_id - len(rows) + 1, last_id)
+
+    def _insert_compact(self, rows):
+        """Insert into readings; the rollups read the new rows back through the sensor_readings view."""
+        compact = {}
+        for row in rows:
+            row = to_compact(row)
+            compact.setdefault(row[0], row)
+        first, last = min(compact), max(compact)
+        existing = {time for time, in self.conn.execute(
+            "SELECT time FROM readings WHERE time BETWEEN ? AND ?", (first, last))}
+        new_rows = [row for time, row in sorted(compact.items()) if time not in existing]
+        if len(new_rows) < len(rows):
+            writer_logger.warning(f"Dropped {len(rows) - len(new_rows)} readings for seconds already stored.")
+        self.conn.executemany(self.compact_insert_sql, new_rows)
+        if self.maintain_rollups:
+            if not existing:
+                update_rollups(self.conn, first, last)
+            else:
+                # The range holds older rows, which must not be counted twice
+                for row in new_rows:
+                    update_rollups(self.conn, row[0], row[0])
+
+    def close(self):
+        """Flush whatever is still buffered and close the connection."""
+        try:
+            written = self.flush()
+            if written:
+                writer_logger.info(f"Flushed {written} buffered rows on shutdown.")
+        finally:
+            self.conn.close()
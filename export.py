@@ -0,0 +1,127 @@
+import io
+import csv
+import sys
+import json
+import argparse
+from data_storage import iter_readings, parse_timestamp, DB_PATH, EXPORT_CHUNK_ROWS
+from rollups import METRICS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+# Constants
+PARQUET_ROW_GROUP = 20000  # Rows per Parquet row group; one group is held in memory at a time
+
+# Export formats and their MIME types
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_csv(chunks, columns):
+    """Yield a header line, then one encoded block of CSV lines per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    yield buffer.getvalue().encode()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+def export_ndjson(chunks, columns):
+    """Yield one encoded block of JSON lines, one object per reading, per chunk."""
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n" for row in rows).encode()
+
+
+class _ByteSink(io.RawIOBase):
+    """Write-only file that keeps what was written until drained; the Parquet writer's output."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def export_parquet(chunks, columns):
+    """Yield a Parquet file one row group per chunk; the footer comes last."""
+    schema = pa.schema([("id", pa.int64()), ("timestamp", pa.string())]
+                       + [(metric, pa.float64()) for metric in columns[2:]])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+EXPORTERS = {"csv": export_csv, "ndjson": export_ndjson, "parquet": export_parquet}
+
+
+def export(fmt, start=None, end=None, metrics=METRICS, db_path=DB_PATH):
+    """
+    Stream the readings in [start, end) in one of FORMATS, in constant memory.
+    Arguments are checked before anything is read, so callers can report errors
+    before the first byte is sent.
+    :return: Generator of bytes.
+    """
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown format: {fmt}")
+    if fmt == "parquet" and pq is None:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+    metrics = list(metrics)
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+    start = None if start is None else parse_timestamp(start)
+    end = None if end is None else parse_timestamp(end)
+    chunk_rows = PARQUET_ROW_GROUP if fmt == "parquet" else EXPORT_CHUNK_ROWS
+    chunks = iter_readings(start, end, metrics, chunk_rows=chunk_rows, db_path=db_path)
+    return EXPORTERS[fmt](chunks, ["id", "timestamp"] + metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export sensor readings for offline analysis")
+    parser.add_argument("--start", help="Inclusive start, 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--end", help="Exclusive end, 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--metrics", default=",".join(METRICS), help="Comma-separated metrics to export")
+    parser.add_argument("--output", default="-", help="Output file, or - for stdout")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    stream = export(args.format, args.start, args.end, args.metrics.split(","), args.db)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for data in stream:
+            out.write(data)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data_storage
+from compact_schema import migrate, drop_legacy
+
+# Compare the text-timestamp sensor_readings table with the compact layout:
+# file size, conversion time and range-scan speed. Run from the repository root:
+#   python3 helper_script/benchmark_compact_schema.py --rows 200000
+# Rollup tables are left out, so the sizes are those of the readings alone.
+
+START = datetime(2023, 1, 1)
+
+
+def build_legacy(db_path, rows, step):
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE sensor_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            temperature REAL,
+            humidity REAL,
+            soil_moisture REAL,
+            cpu_temperature REAL,
+            lux REAL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_sensor_readings_timestamp ON sensor_readings (timestamp)")
+    conn.executemany(
+        "INSERT INTO sensor_readings (timestamp, temperature, humidity, soil_moisture, cpu_temperature, lux) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (((START + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S"),
+          round(random.uniform(5, 35), 3), round(random.uniform(30, 90), 3), round(random.uniform(10, 60), 3),
+          round(random.uniform(40, 70), 3), round(random.uniform(0, 20000), 3)) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def vacuumed_size(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(db_path)
+
+
+def time_scans(db_path, windows, repeats):
+    """Seconds per uncached query_readings and SensorSeries.from_db call over the windows."""
+    results = {}
+    for name, scan in (("query_readings", data_storage.query_readings), ("SensorSeries", data_storage.SensorSeries.from_db)):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for start, end in windows:
+                data_storage.invalidate_cache()
+                scan(start, end, db_path=db_path)
+        results[name] = (time.perf_counter() - started) / (repeats * len(windows))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compact sensor_readings layout")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--step", type=int, default=600, help="Seconds between readings")
+    parser.add_argument("--window-days", type=int, default=7, help="Length of each scanned range")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    span = args.rows * args.step
+    windows = []
+    for _ in range(10):
+        start = START + timedelta(seconds=random.uniform(0, max(0, span - args.window_days * 86400)))
+        windows.append((start.strftime("%Y-%m-%d %H:%M:%S"),
+                        (start + timedelta(days=args.window_days)).strftime("%Y-%m-%d %H:%M:%S")))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        build_legacy(db_path, args.rows, args.step)
+        legacy_size = vacuumed_size(db_path)
+        legacy = time_scans(db_path, windows, args.repeats)
+
+        started = time.perf_counter()
+        migrate(db_path)
+        converted = time.perf_counter() - started
+        drop_legacy(db_path)
+        compact_size = vacuumed_size(db_path)
+        compact = time_scans(db_path, windows, args.repeats)
+
+    print(f"{args.rows} rows converted in {converted:.2f} s")
+    print(f"{'layout':<10}{'bytes/row':>12}{'query_readings ms':>20}{'SensorSeries ms':>18}")
+    for name, size, scans in (("legacy", legacy_size, legacy), ("compact", compact_size, compact)):
+        print(f"{name:<10}{size / args.rows:>12.1f}{scans['query_readings'] * 1000:>20.2f}"
+              f"{scans['SensorSeries'] * 1000:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import io
+import os
+import sys
+import time
+import contextlib
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_writer import BatchedWriter
+from init_database import initialize_database
+
+# Benchmark the per-row connect/insert/commit path used by data_update before
+# the batched writer, against BatchedWriter. Run from the repository root:
+#   python3 helper_script/benchmark_db_writer.py --rows 2000
+# fsyncs are counted with strace when it is installed.
+
+START = 1704106800  # 2024-01-01 12:00:00 local time; each row is one second later
+VALUES = (21.5, 55.0, 48.7, 45.2, 320.0)
+
+
+def run_legacy(db_path, rows):
+    """One connection, insert and commit per row, as data_update used to do."""
+    for i in range(rows):
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO sensor_readings (timestamp, temperature, humidity, soil_moisture, cpu_temperature, lux)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (START + i,) + VALUES,
+        )
+        conn.commit()
+        conn.close()
+    return rows  # One commit per row
+
+
+def run_batched(db_path, rows, batch_size):
+    writer = BatchedWriter(db_path, batch_size=batch_size, flush_interval=3600)
+    commits = 0
+    for i in range(rows):
+        writer.add((START + i,) + VALUES)
+        if not writer.buffer:
+            commits += 1
+    if writer.buffer:
+        commits += 1
+    writer.close()
+    return commits
+
+
+def run_mode(mode, db_path, rows, batch_size):
+    with contextlib.redirect_stdout(io.StringIO()):
+        initialize_database(db_path)
+    start = time.perf_counter()
+    commits = run_legacy(db_path, rows) if mode == "legacy" else run_batched(db_path, rows, batch_size)
+    elapsed = time.perf_counter() - start
+    return elapsed, commits
+
+
+def count_fsyncs(mode, rows, batch_size):
+    """Re-run one mode under strace and return the number of fsync/fdatasync calls."""
+    with tempfile.TemporaryDirectory() as tmp:
+        trace_file = os.path.join(tmp, "trace.txt")
+        subprocess.run(
+            ["strace", "-f", "-c", "-e", "trace=fsync,fdatasync", "-o", trace_file,
+             sys.executable, os.path.abspath(__file__), "--mode", mode, "--rows", str(rows),
+             "--batch-size", str(batch_size), "--db", os.path.join(tmp, "bench.db")],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        fsyncs = 0
+        with open(trace_file) as f:
+            # Summary columns: % time, seconds, usecs/call, calls, [errors,] syscall
+            for line in f:
+                parts = line.split()
+                if parts and parts[-1] in ("fsync", "fdatasync"):
+                    fsyncs += int(parts[3])
+        return fsyncs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sensor_readings write paths")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--mode", choices=["legacy", "batched"], help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Child process started by count_fsyncs
+        run_mode(args.mode, args.db, args.rows, args.batch_size)
+        return
+
+    has_strace = shutil.which("strace") is not None
+    print(f"{'path':<10}{'rows/s':>12}{'commits/row':>14}{'fsyncs/row':>14}")
+    for mode in ("legacy", "batched"):
+        with tempfile.TemporaryDirectory() as tmp:
+            elapsed, commits = run_mode(mode, os.path.join(tmp, "bench.db"), args.rows, args.batch_size)
+        fsyncs = f"{count_fsyncs(mode, args.rows, args.batch_size) / args.rows:.3f}" if has_strace else "n/a"
+        print(f"{mode:<10}{args.rows / elapsed:>12.0f}{commits / args.rows:>14.3f}{fsyncs:>14}")
+    if not has_strace:
+        print("Install strace to count fsyncs per row.")
+
+
+if __name__ == "__main__":
+    main()
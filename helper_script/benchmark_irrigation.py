@@ -0,0 +1,127 @@
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from irrigation_model import MoistureModel, plan_pulse, needs_water
+
+# Simulate a zone over several days and compare the fixed-duration policy
+# (water `duration` seconds below `threshold`) with closed-loop pulse mode.
+# Run from the repository root:
+#   python3 helper_script/benchmark_irrigation.py --days 14
+
+STEP = 10  # Simulation step (in seconds)
+CHECK_INTERVAL = 3600  # Fixed mode checks the probe once an hour, like the watering schedule
+
+
+class SoilSimulator:
+    """
+    Soil moisture (%) driven by a pump. Water reaches the probe with a lag:
+    pumped water first sits in a surface store that infiltrates at a fixed rate.
+    Evapotranspiration follows a day/night cycle and readings carry sensor noise.
+    """
+
+    def __init__(self, moisture=75.0, gain=0.4, infiltration=1 / 90, et_rate=1.5, noise=0.5, seed=1):
+        self.moisture = moisture
+        self.gain = gain  # % added per second of pumping, once infiltrated
+        self.infiltration = infiltration  # Fraction of the surface store reaching the probe per second
+        self.et_rate = et_rate  # Peak evapotranspiration (in % per hour)
+        self.noise = noise
+        self.surface = 0.0
+        self.random = random.Random(seed)
+
+    def step(self, t, dt, pumping):
+        if pumping:
+            self.surface += self.gain * dt
+        infiltrated = self.surface * min(1.0, self.infiltration * dt)
+        self.surface -= infiltrated
+        hour = (t / 3600) % 24
+        daylight = max(0.0, 1 - abs(hour - 13) / 7)  # Peaks at 13:00, zero at night
+        self.moisture += infiltrated - self.et_rate * daylight * dt / 3600
+        self.moisture = min(max(self.moisture, 0.0), 100.0)
+
+    def read(self):
+        return round(self.moisture + self.random.gauss(0, self.noise), 1)
+
+
+def simulate(policy, args):
+    """
+    Run one policy against a fresh simulator.
+    :return: (liters pumped, fraction of time within target +/- band, pump starts)
+    """
+    soil = SoilSimulator(gain=args.gain, noise=args.noise, seed=args.seed)
+    model = MoistureModel()
+    pump_until = 0
+    soak_until = None
+    pulse = None  # (moisture before, duration) of the pulse being soaked
+    pulses = 0
+    pump_seconds = 0
+    in_band = 0
+    starts = 0
+
+    total = int(args.days * 86400)
+    for t in range(0, total, STEP):
+        pumping = t < pump_until
+        soil.step(t, STEP, pumping)
+        pump_seconds += STEP if pumping else 0
+        in_band += abs(soil.moisture - args.target) <= args.band
+
+        if pumping:
+            continue
+        if policy == "fixed":
+            if t % CHECK_INTERVAL == 0 and soil.read() < args.threshold:
+                pump_until = t + args.duration
+                starts += 1
+        elif soak_until is not None:
+            if t >= soak_until:
+                moisture = soil.read()
+                model.update(pulse[0], moisture, pulse[1])
+                soak_until = None
+                pulses += 1
+                duration = plan_pulse(model, moisture, args.target, args.min_pulse, args.max_pulse)
+                if duration and pulses < args.max_pulses:
+                    pump_until = t + max(STEP, round(duration / STEP) * STEP)
+                    soak_until = pump_until + args.soak
+                    pulse = (moisture, duration)
+                    starts += 1
+        elif t % CHECK_INTERVAL == 0:
+            moisture = soil.read()
+            if needs_water(moisture, args.target, args.hysteresis):
+                pulses = 0
+                duration = plan_pulse(model, moisture, args.target, args.min_pulse, args.max_pulse)
+                pump_until = t + max(STEP, round(duration / STEP) * STEP)
+                soak_until = pump_until + args.soak
+                pulse = (moisture, duration)
+                starts += 1
+
+    liters = pump_seconds / 60 * args.flow_rate
+    return liters, in_band / (total // STEP), starts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fixed-duration and pulse-mode irrigation on a simulated zone")
+    parser.add_argument("--days", type=float, default=14)
+    parser.add_argument("--gain", type=float, default=0.4, help="True moisture gain per pumped second (in %%)")
+    parser.add_argument("--noise", type=float, default=0.5, help="Sensor noise std-dev (in %%)")
+    parser.add_argument("--flow-rate", type=float, default=4.0, help="Pump flow rate (in liters per minute)")
+    parser.add_argument("--threshold", type=float, default=75.0, help="Fixed mode: water below this moisture")
+    parser.add_argument("--duration", type=int, default=45, help="Fixed mode: seconds per watering")
+    parser.add_argument("--target", type=float, default=80.0)
+    parser.add_argument("--hysteresis", type=float, default=5.0)
+    parser.add_argument("--band", type=float, default=5.0, help="Half-width of the band counted as on target")
+    parser.add_argument("--min-pulse", type=float, default=2)
+    parser.add_argument("--max-pulse", type=float, default=15)
+    parser.add_argument("--max-pulses", type=int, default=6)
+    parser.add_argument("--soak", type=int, default=300, help="Pulse mode: soak time before re-reading (in seconds)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'policy':<8}{'liters':>10}{'in band':>10}{'starts':>8}")
+    for policy in ("fixed", "pulse"):
+        liters, in_band, starts = simulate(policy, args)
+        print(f"{policy:<8}{liters:>10.1f}{in_band:>10.1%}{starts:>8}")
+
+
+if __name__ == "__main__":
+    main()
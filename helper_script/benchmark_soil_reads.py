@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import i2c_bus
+from i2c_bus import FakeSMBus, FakeADS7830
+from sensor_utils import read_soil_moisture_burst, ADC_ADDRESS
+
+# Measure burst soil reads: bursts per second and the spread of the filtered
+# value for each burst size and filter. Run from the repository root:
+#   python3 helper_script/benchmark_soil_reads.py --fake --noise 3 --spike-rate 0.05
+# Without --fake the real ADS7830 is read, so keep the probe in stable soil.
+
+
+class SpikyADS7830(FakeADS7830):
+    """FakeADS7830 that occasionally returns a full-scale glitch, like a noisy cable."""
+
+    def __init__(self, channels=None, noise=0.0, spike_rate=0.0):
+        super().__init__(channels, noise)
+        self.spike_rate = spike_rate
+
+    def read_byte(self):
+        if random.random() < self.spike_rate:
+            return random.choice((0, 255))
+        return super().read_byte()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark burst soil moisture reads")
+    parser.add_argument("--channel", type=int, default=0)
+    parser.add_argument("--sizes", default="1,3,5,9,15,25", help="Comma-separated burst sizes")
+    parser.add_argument("--delay", type=float, default=0.001, help="Seconds between samples in a burst")
+    parser.add_argument("--repeats", type=int, default=200, help="Bursts per size and filter")
+    parser.add_argument("--fake", action="store_true", help="Use a simulated ADS7830")
+    parser.add_argument("--raw", type=int, default=160, help="Fake: true raw ADC value")
+    parser.add_argument("--noise", type=float, default=3.0, help="Fake: gaussian noise (in ADC counts)")
+    parser.add_argument("--spike-rate", type=float, default=0.0, help="Fake: fraction of glitched samples")
+    args = parser.parse_args()
+
+    if args.fake:
+        device = SpikyADS7830({args.channel: args.raw}, args.noise, args.spike_rate)
+        i2c_bus.bus_manager.bus_factory = lambda bus_number: FakeSMBus(bus_number, {ADC_ADDRESS: device})
+        i2c_bus.bus_manager.close_all()
+
+    print(f"{'N':>4}{'filter':>9}{'bursts/s':>11}{'std-dev %':>11}{'max err %':>11}{'variance':>10}")
+    for size in (int(n) for n in args.sizes.split(",")):
+        for method in ("mean", "trimmed", "median"):
+            values = []
+            variances = []
+            started = time.perf_counter()
+            for _ in range(args.repeats):
+                value, variance = read_soil_moisture_burst(args.channel, size, args.delay, method)
+                values.append(value)
+                variances.append(variance)
+            elapsed = time.perf_counter() - started
+            center = statistics.median(values)
+            print(f"{size:>4}{method:>9}{args.repeats / elapsed:>11.0f}{statistics.pstdev(values):>11.2f}"
+                  f"{max(abs(v - center) for v in values):>11.2f}{statistics.fmean(variances):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
+import sys
 import eventlet
 import socketio
 import time
 from smbus2 import SMBus
 from eventlet.green import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sensor_utils
+
 # Create a Socket.IO server
 sio = socketio.Server(cors_allowed_origins="*")  # Allow all origins
 
@@ -19,27 +23,11 @@ ADC_ADDRESS = 0x48  # I2C address for ADC
 ADC_CHANNEL = 0     # ADC channel connected to the soil moisture sensor
 SHT31_ADDRESS = 0x44  # I2C address for SHT31-D sensor
 TEMP_COMMAND = [0x2C, 0x06]  # Command to read temperature and humidity from SHT31-D
-DRY_SOIL_ADC = 191  # ADC value for dry soil
-WET_SOIL_ADC = 100  # ADC value for wet soil
-
-# Function to convert ADC value to soil moisture percentage
-def convert_to_percentage(raw_value, dry_value=DRY_SOIL_ADC, wet_value=WET_SOIL_ADC):
-    if raw_value >= dry_value:
-        return 0.0  # Completely dry
-    elif raw_value <= wet_value:
-        return 100.0  # Fully wet
-    percentage = ((dry_value - raw_value) / (dry_value - wet_value)) * 100
-    return round(percentage, 2)
-
-# Function to read soil moisture from the ADC
+
+# Function to read soil moisture from the ADC, using the shared per-channel calibration
 def read_soil_moisture(channel, adc_address=ADC_ADDRESS):
     try:
-        bus = SMBus(1)  # Use I2C bus 1
-        assert 0 <= channel <= 7, "Invalid ADC channel. Must be between 0 and 7."
-        command = 0x84 | (channel << 4)
-        bus.write_byte(adc_address, command)
-        raw_value = bus.read_byte(adc_address)
-        return convert_to_percentage(raw_value)
+        return sensor_utils.read_soil_moisture(channel, adc_address)
     except Exception as e:
         print(f"Error reading soil moisture: {e}")
         return None
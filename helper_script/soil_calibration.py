@@ -1,57 +1,66 @@
-from smbus2 import SMBus
-import time
+import os
+import sys
+import argparse
+import statistics
 
-# Define the I2C address of the ADS7830
-ADS7830_ADDRESS = 0x48
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sensor_utils import read_soil_raw, load_soil_calibration, save_soil_calibration, CALIBRATION_FILE
 
-# Initialize the I2C bus
-bus = SMBus(1)  # Use I2C bus 1
+# Record dry and wet ADC values for each soil probe and store them in the
+# calibration file read by sensor_utils. Run from the repository root:
+#   python3 helper_script/soil_calibration.py --channels 0,1
 
-# Read the ADC channel
-def read_adc(channel):
+SAMPLES = 25  # Samples per calibration reading; the median is stored
+
+
+def read_adc(channel, samples=SAMPLES):
     """
-    Reads the analog value from the specified ADS7830 channel.
+    Reads the ADS7830 channel several times and returns the median raw value.
     :param channel: ADC channel (0 to 7)
     :return: ADC value (0 to 255)
     """
     if channel < 0 or channel > 7:
         raise ValueError("Channel must be between 0 and 7")
-    
-    command = 0x84 | (channel << 4)  # Configure the ADS7830 command for the selected channel
-    bus.write_byte(ADS7830_ADDRESS, command)
-    return bus.read_byte(ADS7830_ADDRESS)
+    return round(statistics.median(read_soil_raw([channel], samples)[channel]))
+
 
 # Main function
 def main():
+    parser = argparse.ArgumentParser(description="Calibrate soil moisture probes")
+    parser.add_argument("--channels", default="0", help="Comma-separated ADC channels to calibrate")
+    parser.add_argument("--file", default=CALIBRATION_FILE, help="Calibration file to update")
+    args = parser.parse_args()
+
+    table = load_soil_calibration(args.file)
     try:
-        print("Soil Moisture Sensor Calibration Test")
-        print("=====================================")
-        print("Place the sensor in DRY soil and press Enter...")
-        input()  # Wait for user input
-        dry_value = read_adc(0)  # Assuming the sensor is connected to channel 0
-        print(f"Dry soil ADC value: {dry_value}")
-        
-        print("\nPlace the sensor in WET soil and press Enter...")
-        input()  # Wait for user input
-        wet_value = read_adc(0)  # Assuming the sensor is connected to channel 0
-        print(f"Wet soil ADC value: {wet_value}")
-        
-        print("\nOptional: Place the sensor in WATER and press Enter...")
-        input()  # Wait for user input
-        water_value = read_adc(0)
-        print(f"Water ADC value: {water_value}")
-        
-        print("\nCalibration values:")
-        print(f"Dry soil: {dry_value}")
-        print(f"Wet soil: {wet_value}")
-        print(f"Water (optional): {water_value}")
-        
-        print("\nUse these values to calibrate your soil moisture readings.")
+        print("Soil Moisture Sensor Calibration")
+        print("================================")
+        for channel in (int(c) for c in args.channels.split(",")):
+            print(f"\nChannel {channel}: place the sensor in DRY soil and press Enter...")
+            input()  # Wait for user input
+            dry_value = read_adc(channel)
+            print(f"Dry soil ADC value: {dry_value}")
+
+            print(f"Channel {channel}: place the sensor in WET soil and press Enter...")
+            input()  # Wait for user input
+            wet_value = read_adc(channel)
+            print(f"Wet soil ADC value: {wet_value}")
+
+            if dry_value <= wet_value:
+                print(f"Dry value must be above the wet value; channel {channel} not saved.")
+                continue
+            table[channel] = (dry_value, wet_value)
+
+        save_soil_calibration(table, args.file)
+        print(f"\nCalibration saved to {args.file}:")
+        for channel, (dry_value, wet_value) in sorted(table.items()):
+            print(f"Channel {channel}: dry {dry_value}, wet {wet_value}")
     except Exception as e:
         print(f"Error: {e}")
     finally:
         print("Exiting...")
 
+
 # Run the main function
 if __name__ == "__main__":
     main()
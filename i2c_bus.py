@@ -0,0 +1,234 @@
+import os
+import fcntl
+import random
+import threading
+import logging
+from contextlib import contextmanager
+
+# Constants
+I2C_BUS = 1  # I2C bus number (usually 1 for Raspberry Pi)
+LOCK_DIR = "/tmp"  # Directory for the cross-process bus lock files
+FAKE_BUS_ENV = "PIGARDEN_FAKE_I2C"  # Set to 1 to use the fake bus backend
+
+i2c_logger = logging.getLogger('i2c_bus')
+
+
+def sht31_crc(data):
+    """CRC-8 used by the SHT31 (polynomial 0x31, init 0xFF)."""
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class FakeADS7830:
+    """
+    Emulates the ADS7830 ADC: a command byte selects the channel, the next
+    read returns its 8-bit value.
+    :param channels: Mapping of channel number to raw value (0-255).
+    :param noise: Standard deviation of gaussian noise added to each read.
+    """
+
+    def __init__(self, channels=None, noise=0.0):
+        self.channels = dict(channels or {})
+        self.noise = noise
+        self.selected = 0
+
+    def write_byte(self, value):
+        self.selected = (value >> 4) & 0x07
+
+    def read_byte(self):
+        raw_value = self.channels.get(self.selected, 160)
+        if self.noise:
+            raw_value = round(random.gauss(raw_value, self.noise))
+        return max(0, min(255, raw_value))
+
+
+class FakeSHT31:
+    """
+    Emulates the SHT31 single-shot measurement: any command starts a
+    conversion, the block read returns temperature and humidity with CRCs.
+    """
+
+    def __init__(self, temperature=21.5, humidity=55.0, corrupt_rate=0.0):
+        self.temperature = temperature
+        self.humidity = humidity
+        self.corrupt_rate = corrupt_rate  # Fraction of reads returned with a flipped bit
+
+    def write_block(self, register, data):
+        pass
+
+    def read_block(self, register, length):
+        temp_raw = round((self.temperature + 45) * 65535.0 / 175)
+        humidity_raw = round(self.humidity * 65535.0 / 100)
+        temp_bytes = [temp_raw >> 8, temp_raw & 0xFF]
+        humidity_bytes = [humidity_raw >> 8, humidity_raw & 0xFF]
+        data = temp_bytes + [sht31_crc(temp_bytes)] + humidity_bytes + [sht31_crc(humidity_bytes)]
+        if random.random() < self.corrupt_rate:
+            data[random.randrange(6)] ^= 1 << random.randrange(8)
+        return data[:length]
+
+
+class FakeVEML7700:
+    """
+    Emulates the attributes of adafruit_veml7700.VEML7700 used by sensor_utils:
+    gain and integration time settings and the raw ALS count, which saturates
+    at 65535 like the real sensor.
+    :param lux: Simulated illuminance.
+    """
+
+    ALS_GAIN_1 = 0x0
+    ALS_GAIN_2 = 0x1
+    ALS_GAIN_1_8 = 0x2
+    ALS_GAIN_1_4 = 0x3
+    ALS_25MS = 0xC
+    ALS_50MS = 0x8
+    ALS_100MS = 0x0
+    ALS_200MS = 0x1
+    ALS_400MS = 0x2
+    ALS_800MS = 0x3
+
+    GAINS = {ALS_GAIN_1: 1, ALS_GAIN_2: 2, ALS_GAIN_1_8: 0.125, ALS_GAIN_1_4: 0.25}
+    INTEGRATION_TIMES = {ALS_25MS: 25, ALS_50MS: 50, ALS_100MS: 100, ALS_200MS: 200, ALS_400MS: 400, ALS_800MS: 800}
+
+    def __init__(self, lux=300.0):
+        self.lux_value = lux
+        self.light_gain = self.ALS_GAIN_1_8
+        self.light_integration_time = self.ALS_100MS
+
+    @property
+    def light(self):
+        resolution = 0.0036 * (800 / self.INTEGRATION_TIMES[self.light_integration_time]) * (2 / self.GAINS[self.light_gain])
+        return min(65535, int(self.lux_value / resolution))
+
+
+class FakeSMBus:
+    """
+    In-memory stand-in for smbus2.SMBus that routes transactions to fake
+    devices by address. Unknown addresses raise OSError like a NACK would.
+    """
+
+    def __init__(self, bus_number=I2C_BUS, devices=None):
+        self.bus_number = bus_number
+        self.devices = devices if devices is not None else {
+            0x48: FakeADS7830(),
+            0x44: FakeSHT31(),
+        }
+        self.transactions = 0
+
+    def _device(self, address):
+        self.transactions += 1
+        try:
+            return self.devices[address]
+        except KeyError:
+            raise OSError(121, f"Remote I/O error (no device at 0x{address:02x})")
+
+    def write_byte(self, address, value):
+        self._device(address).write_byte(value)
+
+    def read_byte(self, address):
+        return self._device(address).read_byte()
+
+    def write_i2c_block_data(self, address, register, data):
+        self._device(address).write_block(register, data)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self._device(address).read_block(register, length)
+
+    def close(self):
+        pass
+
+
+def _open_smbus(bus_number):
+    from smbus2 import SMBus
+    return SMBus(bus_number)
+
+
+def _open_fake_bus(bus_number):
+    return FakeSMBus(bus_number)
+
+
+class I2CBusManager:
+    """
+    Keeps one open handle per I2C bus for the lifetime of the process and
+    serializes transactions on it, both between threads (a lock per bus) and
+    between processes (an flock on a per-bus lock file).
+    """
+
+    def __init__(self, bus_factory=None, lock_dir=LOCK_DIR):
+        if bus_factory is None:
+            bus_factory = _open_fake_bus if os.environ.get(FAKE_BUS_ENV) == "1" else _open_smbus
+        self.bus_factory = bus_factory
+        self.lock_dir = lock_dir
+        self._buses = {}
+        self._locks = {}
+        self._lock_files = {}
+        self._depths = {}  # bus number -> nesting depth of the thread holding its lock
+        self._guard = threading.Lock()
+
+    def _lock_for(self, bus_number):
+        with self._guard:
+            if bus_number not in self._locks:
+                self._locks[bus_number] = threading.RLock()
+                if self.lock_dir:
+                    lock_path = os.path.join(self.lock_dir, f"pigarden_i2c_{bus_number}.lock")
+                    self._lock_files[bus_number] = open(lock_path, "a")
+            return self._locks[bus_number]
+
+    def get_bus(self, bus_number=I2C_BUS):
+        """Return the shared handle for a bus, opening it on first use."""
+        bus = self._buses.get(bus_number)
+        if bus is None:
+            bus = self.bus_factory(bus_number)
+            self._buses[bus_number] = bus
+            i2c_logger.info(f"Opened I2C bus {bus_number}")
+        return bus
+
+    @contextmanager
+    def session(self, bus_number=I2C_BUS):
+        """
+        Hold exclusive access to a bus for a multi-step transaction.
+        If the transaction fails with an OSError the handle is dropped so the
+        next session reopens the bus. Sessions may nest within a thread; the
+        file lock is taken by the outermost one and held until it ends.
+        """
+        lock = self._lock_for(bus_number)
+        with lock:
+            depth = self._depths.get(bus_number, 0)
+            lock_file = self._lock_files.get(bus_number) if depth == 0 else None
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._depths[bus_number] = depth + 1
+            try:
+                yield self.get_bus(bus_number)
+            except OSError:
+                self.close(bus_number)
+                raise
+            finally:
+                self._depths[bus_number] = depth
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def close(self, bus_number=I2C_BUS):
+        """Close the handle for a bus; the next session reopens it."""
+        bus = self._buses.pop(bus_number, None)
+        if bus is not None:
+            try:
+                bus.close()
+            except Exception as e:
+                i2c_logger.error(f"Error closing I2C bus {bus_number}: {e}")
+
+    def close_all(self):
+        for bus_number in list(self._buses):
+            self.close(bus_number)
+
+
+# Shared manager used by all sensor reads in this process
+bus_manager = I2CBusManager()
+
+
+def bus_session(bus_number=I2C_BUS):
+    """Exclusive access to the shared handle of an I2C bus."""
+    return bus_manager.session(bus_number)
@@ -1,11 +1,127 @@
 import sqlite3
+from compact_schema import CREATE_READINGS, upgrade
 
-def initialize_database():
-    """Initialize the sensor_data database with all required fields."""
+DB_PATH = "sensor_data.db"
+
+# Schema migrations applied after the base table exists. PRAGMA user_version
+# stores how many of them a database has already run, so only new entries
+# are applied. Append new migrations to the end; never reorder them.
+MIGRATIONS = [
+    # 1: Index for time-range queries on sensor_readings
+    [
+        "CREATE INDEX IF NOT EXISTS idx_sensor_readings_timestamp ON sensor_readings (timestamp)",
+    ],
+    # 2: Minute/hour/day rollups maintained by the writer (fill with `python3 rollups.py --backfill`)
+    [
+        f"""
+        CREATE TABLE IF NOT EXISTS sensor_rollup_{resolution} (
+            bucket TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            min REAL,
+            max REAL,
+            sum REAL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (bucket, metric)
+        ) WITHOUT ROWID;
+        """
+        for resolution in ("minute", "hour", "day")
+    ],
+    # 3: Per-zone watering log written by irrigation_system
+    [
+        """
+        CREATE TABLE IF NOT EXISTS irrigation_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            zone TEXT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            duration REAL NOT NULL,
+            volume_liters REAL NOT NULL,
+            moisture_before REAL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_irrigation_events_zone_timestamp ON irrigation_events (zone, timestamp)",
+    ],
+    # 4: Post-soak reading for each pulse, used to fit the per-zone moisture model
+    [
+        "ALTER TABLE irrigation_events ADD COLUMN moisture_after REAL",
+    ],
+    # 5: Per-interval aggregates of high-rate samples, detected events and raw samples around them
+    [
+        """
+        CREATE TABLE IF NOT EXISTS sensor_aggregates (
+            bucket TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            seconds INTEGER NOT NULL,
+            min REAL,
+            max REAL,
+            mean REAL,
+            last REAL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (bucket, metric)
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sensor_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME NOT NULL,
+            kind TEXT NOT NULL,
+            detail TEXT
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sensor_events_timestamp ON sensor_events (timestamp)",
+        """
+        CREATE TABLE IF NOT EXISTS sensor_raw_samples (
+            time REAL PRIMARY KEY,
+            temperature REAL,
+            humidity REAL,
+            soil_moisture REAL,
+            cpu_temperature REAL,
+            lux REAL
+        ) WITHOUT ROWID;
+        """,
+    ],
+    # 6: Compact readings keyed by Unix time (sensor_readings is switched over by compact_schema.py)
+    [
+        CREATE_READINGS,
+    ],
+    # 7: Replication cursors: on a node the last id acknowledged by each collector,
+    # on a collector's per-node database the last id received from that node
+    [
+        """
+        CREATE TABLE IF NOT EXISTS replication_state (
+            peer TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        """,
+    ],
+]
+
+def migrate_database(conn, quiet=False):
+    """
+    Apply any migrations the database has not run yet.
+    :param quiet: Don't print the migrations applied.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+        if not quiet:
+            print(f"Applied database migration {number}.")
+
+def initialize_database(db_path=DB_PATH, quiet=False):
+    """
+    Initialize the sensor_data database with all required fields.
+    :param quiet: Only print errors, for databases created by a running service.
+    """
     try:
-        conn = sqlite3.connect("sensor_data.db")
+        conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
+        # Only takes effect on a new database; retention.py can convert existing ones
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
         # Create a new table with all fields if it doesn't exist
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS sensor_readings (
@@ -20,7 +136,12 @@ def initialize_database():
         """)
 
         conn.commit()
-        print("Database initialized with all fields!")
+        migrate_database(conn, quiet)
+
+        # New databases start in the compact layout; existing ones are converted with compact_schema.py
+        upgrade(db_path)
+        if not quiet:
+            print("Database initialized with all fields!")
     except sqlite3.Error as e:
         print(f"Error initializing database: {e}")
     finally:
@@ -0,0 +1,101 @@
+import sqlite3
+import statistics
+from datetime import datetime, timedelta
+from compact_schema import is_compact, local_to_epoch, TIMESTAMP_FORMAT
+
+DB_PATH = "sensor_data.db"
+DEFAULT_GAIN = 0.5  # Initial estimate of soil moisture gained per second of pumping (in %)
+MIN_GAIN = 0.01  # Lower bound so a bad estimate cannot request endless pulses
+GAIN_SMOOTHING = 0.3  # Weight of the newest observation in the running gain estimate
+PULSE_FILL = 0.7  # Fraction of the remaining deficit a single pulse aims to fill
+HISTORY_EVENTS = 20  # Recent watering events used to seed a zone's model
+READINGS_CHANNEL = 0  # The soil channel stored in sensor_readings.soil_moisture
+
+
+class MoistureModel:
+    """
+    Per-zone estimate of how much soil moisture (%) one second of pumping adds,
+    updated from each pulse's before/after readings.
+    """
+
+    def __init__(self, gain=DEFAULT_GAIN, smoothing=GAIN_SMOOTHING):
+        self.gain = gain
+        self.smoothing = smoothing
+        self.observations = 0
+
+    def update(self, before, after, duration):
+        """Fold one pulse's observed moisture gain into the estimate."""
+        if duration <= 0 or before is None or after is None:
+            return
+        observed = max((after - before) / duration, MIN_GAIN)
+        self.gain = (1 - self.smoothing) * self.gain + self.smoothing * observed
+        self.observations += 1
+
+    @classmethod
+    def from_history(cls, zone, soil_channel, soak_delay, db_path=DB_PATH):
+        """
+        Seed a model from the zone's recent irrigation_events. Events without a
+        recorded moisture_after use the first sensor_readings row taken at least
+        soak_delay after the pump stopped, when the zone's probe is the one stored there.
+        """
+        model = cls()
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                events = conn.execute(
+                    """
+                    SELECT duration, moisture_before, moisture_after, timestamp FROM irrigation_events
+                    WHERE zone = ? AND duration > 0 AND moisture_before IS NOT NULL
+                    ORDER BY timestamp DESC LIMIT ?
+                    """,
+                    (zone, HISTORY_EVENTS),
+                ).fetchall()
+                rows = []
+                for duration, before, after, timestamp in events:
+                    if after is None and soil_channel == READINGS_CHANNEL:
+                        after = _reading_after(conn, timestamp, soak_delay)
+                    rows.append((duration, before, after))
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError):
+            return model
+
+        gains = [(after - before) / duration for duration, before, after in rows
+                 if after is not None and after > before]
+        if gains:
+            model.gain = max(statistics.median(gains), MIN_GAIN)
+            model.observations = len(gains)
+        return model
+
+
+def _reading_after(conn, timestamp, soak_delay):
+    """
+    Soil moisture of the first sensor_readings row at least soak_delay after the
+    local timestamp; in the compact layout a rowid seek on the Unix time.
+    """
+    if is_compact(conn):
+        key, bound = "id", local_to_epoch(timestamp)[0] + int(soak_delay)
+    else:
+        key = "timestamp"
+        bound = (datetime.strptime(timestamp, TIMESTAMP_FORMAT) + timedelta(seconds=int(soak_delay))).strftime(TIMESTAMP_FORMAT)
+    row = conn.execute(
+        f"SELECT soil_moisture FROM sensor_readings WHERE {key} >= ? ORDER BY {key} LIMIT 1", (bound,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def plan_pulse(model, moisture, target, min_pulse, max_pulse, fill=PULSE_FILL):
+    """
+    Size the next pulse from the current reading and the zone's model.
+    :return: Pulse duration in seconds, or 0 once the target is reached.
+    """
+    deficit = target - moisture
+    if deficit <= 0:
+        return 0
+    duration = fill * deficit / max(model.gain, MIN_GAIN)
+    return round(min(max(duration, min_pulse), max_pulse), 1)
+
+
+def needs_water(moisture, target, hysteresis):
+    """Start a watering cycle only once moisture falls below the lower edge of the band."""
+    return moisture < target - hysteresis
@@ -4,10 +4,32 @@ import schedule
 import logging
 from datetime import datetime
 import os
-from sensor_utils import read_soil_moisture
+import sys
+import json
+import signal
+import sqlite3
+import threading
+from collections import deque
+import pytz
+from sensor_client import get_snapshot
+from state_registry import get_registry, HEARTBEAT_INTERVAL
+from irrigation_model import MoistureModel, plan_pulse, needs_water
+import metrics
 
-# Define relay channel for irrigation
-relay_ch = OutputDevice(24, active_high=False, initial_value=False)
+SNAPSHOT_MAX_AGE = 60  # Ignore sensor snapshots older than this (in seconds)
+DB_PATH = "sensor_data.db"
+MAX_CONCURRENT_PUMPS = 2  # Pumps allowed to run at once, to protect the water supply
+SOAK_RETRY_DELAY = 5  # Wait this long for a sensor snapshot taken after the soak (in seconds)
+
+# Zones can be configured in irrigation_zones.json:
+# {"max_concurrent_pumps": 2, "zones": [{"name": "bed1", "relay_pin": 24, "soil_channel": 0,
+#   "threshold": 90.0, "duration": 15, "flow_rate": 4.0}, ...]}
+# Zones with "mode": "pulse" water in short pulses until "target" is reached instead
+# (see Zone for the pulse settings).
+ZONES_FILE = "irrigation_zones.json"
+DEFAULT_ZONES = [
+    {"name": "zone0", "relay_pin": 24, "soil_channel": 0, "threshold": 90.0, "duration": 15, "flow_rate": 4.0},
+]
 
 # Create logs directory if it doesn't exist
 log_dir = "logs"
@@ -22,62 +44,316 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-def water_plants(duration):
+relay_actuations = metrics.counter("pigarden_relay_actuations_total", "Relay switches, by relay and new state")
+pumps_running = metrics.gauge("pigarden_pumps_running", "Pumps currently running")
+pumps_queued = metrics.gauge("pigarden_pumps_queued", "Waterings waiting for a free pump")
+watering_seconds = metrics.counter("pigarden_watering_seconds_total", "Time pumps have run, by zone")
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
+
+
+class Zone:
     """
-    Function to water plants by turning the relay on for a specified duration.
-    :param duration: Duration in seconds for which the pump should run.
+    One irrigation zone: a pump relay, the soil probe that watches it and its watering settings.
+    :param name: Zone name used in logs and the state registry.
+    :param relay_pin: GPIO pin of the pump relay.
+    :param soil_channel: ADS7830 channel of the zone's soil probe.
+    :param threshold: Water when soil moisture (%) is below this.
+    :param duration: Default watering duration in seconds.
+    :param flow_rate: Pump flow rate in liters per minute, for volume logging.
+    :param mode: 'fixed' waters for `duration` below `threshold`; 'pulse' runs closed-loop pulses.
+    :param target: Pulse mode: moisture (%) at which a watering cycle stops.
+    :param hysteresis: Pulse mode: a cycle starts only below target - hysteresis.
+    :param min_pulse: Pulse mode: shortest pulse in seconds.
+    :param max_pulse: Pulse mode: longest pulse in seconds.
+    :param soak_delay: Pulse mode: seconds to let water soak in before re-reading the probe.
+    :param max_pulses: Pulse mode: upper bound on pulses per cycle.
     """
-    try:
-        logging.info(f"Starting the pump for {duration} seconds.")
-        relay_ch.on()  # Turn on the pump
-        time.sleep(duration)  # Keep the pump running
-        logging.info("Stopping the pump.")
-        relay_ch.off()  # Turn off the pump
-    except Exception as e:
-        logging.error(f"An error occurred while watering: {e}")
-
-def check_and_water(duration):
+
+    def __init__(self, name, relay_pin, soil_channel, threshold=90.0, duration=15, flow_rate=4.0,
+                 mode="fixed", target=80.0, hysteresis=5.0, min_pulse=2, max_pulse=15, soak_delay=120,
+                 max_pulses=6):
+        self.name = name
+        self.relay_pin = relay_pin
+        self.soil_channel = soil_channel
+        self.threshold = threshold
+        self.duration = duration
+        self.flow_rate = flow_rate
+        self.mode = mode
+        self.target = target
+        self.hysteresis = hysteresis
+        self.min_pulse = min_pulse
+        self.max_pulse = max_pulse
+        self.soak_delay = soak_delay
+        self.max_pulses = max_pulses
+        self.model = MoistureModel()
+        self.relay = OutputDevice(relay_pin, active_high=False, initial_value=False)
+
+
+class IrrigationController:
     """
-    Check soil moisture and water plants if needed.
-    :param duration: Duration in seconds for which the pump should run.
+    Runs several zones without blocking: each watering is a relay on-event plus
+    a timer for the off-event. At most max_concurrent pumps run at once; further
+    requests wait in a FIFO queue and start as soon as a pump stops.
     """
-    try:
-        soil_moisture = read_soil_moisture(channel=0)  # Adjust channel as needed
-        logging.info(f"Current soil moisture: {soil_moisture}%")
-        if soil_moisture < 90.0:
-            logging.info("Soil moisture is below threshold. Watering plants.")
-            water_plants(duration)
-        else:
-            logging.info("Soil moisture is sufficient. No watering needed.")
-    except Exception as e:
-        logging.error(f"Error checking soil moisture: {e}")
-
-def schedule_watering(times, duration):
+
+    def __init__(self, zones, max_concurrent=MAX_CONCURRENT_PUMPS, db_path=DB_PATH):
+        self.zones = {zone.name: zone for zone in zones}
+        self.max_concurrent = max_concurrent
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.active = {}  # zone name -> (timer, start time, moisture before, on_done)
+        self.pending = deque()  # (zone, duration, moisture before, on_done) waiting for a free pump
+        self.cycles = set()  # Names of zones in a pulse cycle, including while soaking
+
+        for zone in zones:
+            if zone.mode == "pulse":
+                zone.model = MoistureModel.from_history(zone.name, zone.soil_channel, zone.soak_delay, db_path)
+                logging.info(f"[{zone.name}] Pulse mode, {zone.model.gain:.3f} %/s from {zone.model.observations} past events.")
+
+    def request_watering(self, zone, duration=None, moisture_before=None, on_done=None):
+        """
+        Start watering a zone now, or queue it if the pump limit is reached.
+        :param on_done: Called with (duration, event id) after the pump has stopped.
+        """
+        duration = zone.duration if duration is None else duration
+        with self.lock:
+            if zone.name in self.active or any(queued[0] is zone for queued in self.pending):
+                logging.info(f"[{zone.name}] Already watering or queued. Ignoring request.")
+                return
+            if len(self.active) < self.max_concurrent:
+                self._start(zone, duration, moisture_before, on_done)
+            else:
+                logging.info(f"[{zone.name}] {len(self.active)} pumps running. Queued for {duration} seconds.")
+                self.pending.append((zone, duration, moisture_before, on_done))
+                pumps_queued.set(len(self.pending))
+
+    def _start(self, zone, duration, moisture_before, on_done):
+        logging.info(f"[{zone.name}] Starting the pump for {duration} seconds.")
+        zone.relay.on()
+        relay_actuations.inc(relay=zone.name, state="on")
+        timer = threading.Timer(duration, self._stop, args=(zone,))
+        timer.daemon = True
+        self.active[zone.name] = (timer, time.monotonic(), moisture_before, on_done)
+        timer.start()
+        self._publish_pump_state()
+
+    def _stop(self, zone):
+        with self.lock:
+            entry = self.active.pop(zone.name, None)
+            zone.relay.off()
+            if entry is None:
+                return
+            relay_actuations.inc(relay=zone.name, state="off")
+            elapsed = time.monotonic() - entry[1]
+            watering_seconds.inc(elapsed, zone=zone.name)
+
+            while self.pending and len(self.active) < self.max_concurrent:
+                self._start(*self.pending.popleft())
+            self._publish_pump_state()
+
+        # Logging and the database write happen after the next pump has started
+        volume = zone.flow_rate * elapsed / 60
+        logging.info(f"[{zone.name}] Stopping the pump after {elapsed:.1f} seconds, {volume:.2f} L used.")
+        event_id = self._record_event(zone, elapsed, volume, entry[2])
+        if entry[3] is not None:
+            entry[3](elapsed, event_id)
+
+    def _publish_pump_state(self):
+        pumps_running.set(len(self.active))
+        pumps_queued.set(len(self.pending))
+        try:
+            get_registry().publish("pump", "ON" if self.active else "OFF")
+        except Exception as e:
+            errors.inc(component="irrigation_system")
+            logging.error(f"Error publishing pump state: {e}")
+
+    def _record_event(self, zone, duration, volume, moisture_before):
+        """Store the watering in irrigation_events for per-zone volume history. Returns the row id."""
+        try:
+            local_time = datetime.now(pytz.timezone("Europe/Warsaw")).strftime("%Y-%m-%d %H:%M:%S")
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    cursor = conn.execute(
+                        """
+                        INSERT INTO irrigation_events (zone, timestamp, duration, volume_liters, moisture_before)
+                        VALUES (?, ?, ?, ?, ?)
+                        """,
+                        (zone.name, local_time, round(duration, 2), round(volume, 3), moisture_before),
+                    )
+                return cursor.lastrowid
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            errors.inc(component="irrigation_system")
+            logging.error(f"[{zone.name}] Error recording watering event: {e}")
+            return None
+
+    def _record_moisture_after(self, zone, event_id, moisture_after):
+        if event_id is None:
+            return
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute("UPDATE irrigation_events SET moisture_after = ? WHERE id = ?", (moisture_after, event_id))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            errors.inc(component="irrigation_system")
+            logging.error(f"[{zone.name}] Error recording moisture after watering: {e}")
+
+    def start_pulse_cycle(self, zone, moisture):
+        """Water a pulse-mode zone in short pulses, re-reading the probe after each soak, until target."""
+        with self.lock:
+            if zone.name in self.cycles:
+                logging.info(f"[{zone.name}] Pulse cycle already running. Ignoring request.")
+                return
+            self.cycles.add(zone.name)
+        self._next_pulse(zone, moisture, 0)
+
+    def _next_pulse(self, zone, moisture, pulses):
+        duration = plan_pulse(zone.model, moisture, zone.target, zone.min_pulse, zone.max_pulse)
+        if duration == 0 or pulses >= zone.max_pulses:
+            reason = "target reached" if duration == 0 else f"pulse limit of {zone.max_pulses} reached"
+            logging.info(f"[{zone.name}] Pulse cycle done after {pulses} pulses at {moisture}%: {reason}.")
+            with self.lock:
+                self.cycles.discard(zone.name)
+            return
+
+        def on_done(elapsed, event_id):
+            if zone.name not in self.cycles:
+                return  # Cancelled by stop_all
+            soak_end = time.time() + zone.soak_delay
+            timer = threading.Timer(zone.soak_delay, self._after_soak,
+                                    args=(zone, moisture, elapsed, pulses + 1, event_id, soak_end))
+            timer.daemon = True
+            timer.start()
+
+        logging.info(f"[{zone.name}] Pulse {pulses + 1}: {duration} s at {moisture}% (model {zone.model.gain:.3f} %/s).")
+        self.request_watering(zone, duration, moisture, on_done)
+
+    def _after_soak(self, zone, before, duration, pulses, event_id, soak_end):
+        """Re-read the probe after the soak, update the zone model and plan the next pulse."""
+        if zone.name not in self.cycles:
+            logging.info(f"[{zone.name}] Pulse cycle cancelled during the soak.")
+            return
+        snapshot = get_snapshot(max_age=SNAPSHOT_MAX_AGE)
+        if snapshot is not None and snapshot['timestamp'] < soak_end:
+            # The last sample predates the end of the soak; wait for a fresh one
+            timer = threading.Timer(SOAK_RETRY_DELAY, self._after_soak,
+                                    args=(zone, before, duration, pulses, event_id, soak_end))
+            timer.daemon = True
+            timer.start()
+            return
+        after = None if snapshot is None else snapshot.get('soil_channels', {}).get(str(zone.soil_channel))
+        if after is None:
+            logging.error(f"[{zone.name}] No soil moisture after soak. Ending pulse cycle.")
+            with self.lock:
+                self.cycles.discard(zone.name)
+            return
+        zone.model.update(before, after, duration)
+        self._record_moisture_after(zone, event_id, after)
+        self._next_pulse(zone, after, pulses)
+
+    def check_and_water(self, duration=None):
+        """
+        Check every zone's soil moisture from one sensor snapshot and water the dry ones.
+        Returns immediately; pumps are switched off by their timers.
+        :param duration: Override the zones' watering duration (in seconds).
+        """
+        try:
+            snapshot = get_snapshot(max_age=SNAPSHOT_MAX_AGE)
+            if snapshot is None:
+                logging.error("No recent snapshot from the sensor service. Skipping watering.")
+                return
+            soil_channels = snapshot.get('soil_channels', {})
+            for zone in self.zones.values():
+                soil_moisture = soil_channels.get(str(zone.soil_channel))
+                if soil_moisture is None:
+                    logging.error(f"[{zone.name}] No soil moisture for channel {zone.soil_channel}. Skipping.")
+                    continue
+                logging.info(f"[{zone.name}] Current soil moisture: {soil_moisture}%")
+                if zone.mode == "pulse":
+                    if needs_water(soil_moisture, zone.target, zone.hysteresis):
+                        logging.info(f"[{zone.name}] Soil moisture is below the target band. Starting pulse cycle.")
+                        self.start_pulse_cycle(zone, soil_moisture)
+                    else:
+                        logging.info(f"[{zone.name}] Soil moisture is within the target band. No watering needed.")
+                elif soil_moisture < zone.threshold:
+                    logging.info(f"[{zone.name}] Soil moisture is below threshold. Watering plants.")
+                    self.request_watering(zone, duration, soil_moisture)
+                else:
+                    logging.info(f"[{zone.name}] Soil moisture is sufficient. No watering needed.")
+        except Exception as e:
+            errors.inc(component="irrigation_system")
+            logging.error(f"Error checking soil moisture: {e}")
+
+    def stop_all(self):
+        """Cancel queued waterings and switch every pump off."""
+        with self.lock:
+            self.pending.clear()
+            self.cycles.clear()
+            for name, (timer, _, _, _) in list(self.active.items()):
+                timer.cancel()
+                self._stop(self.zones[name])
+            for zone in self.zones.values():
+                zone.relay.off()
+
+
+def load_zones(path=ZONES_FILE):
+    """
+    Load zone settings from a JSON file, falling back to DEFAULT_ZONES.
+    :return: (list of Zone, max concurrent pumps)
+    """
+    config = {"zones": DEFAULT_ZONES}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            config = json.load(f)
+    zones = [Zone(**zone) for zone in config["zones"]]
+    return zones, config.get("max_concurrent_pumps", MAX_CONCURRENT_PUMPS)
+
+
+def schedule_watering(controller, times, duration=None):
     """
     Schedule watering tasks at specific times.
+    :param controller: IrrigationController to run the checks.
     :param times: List of times in "HH:MM" format.
-    :param duration: Duration in seconds for each watering session.
+    :param duration: Duration in seconds for each watering session, or None for each zone's own.
     """
     for watering_time in times:
-        schedule.every().day.at(watering_time).do(check_and_water, duration=duration)
-        #version without sensors
-        #schedule.every().day.at(watering_time).do(water_plants, duration=duration)
-        logging.info(f"Scheduled watering check at {watering_time} for {duration} seconds if needed.")
+        schedule.every().day.at(watering_time).do(controller.check_and_water, duration=duration)
+        logging.info(f"Scheduled watering check at {watering_time} for {duration or 'per-zone'} seconds if needed.")
 
 if __name__ == "__main__":
-    # Define watering schedule and duration
+    # Define watering schedule
     watering_times = ["06:00","13:00", "23:10"]  # Adjust times as needed
-    watering_duration = 15  # Duration in seconds for each session
+
+    zones, max_concurrent = load_zones()
+    metrics.serve_metrics("irrigation_system")
+    controller = IrrigationController(zones, max_concurrent)
 
     # Schedule watering
-    schedule_watering(watering_times, watering_duration)
+    schedule_watering(controller, watering_times)
+
+    # Exit through the finally block below so every pump is switched off
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
 
     # Keep script running to check the schedule
-    logging.info("Irrigation system started. Press Ctrl+C to exit.")
+    registry = get_registry()
+    registry.publish("irrigation_system", "RUNNING")
+    logging.info(f"Irrigation system started with {len(zones)} zones. Press Ctrl+C to exit.")
+    last_heartbeat = 0
     try:
         while True:
             schedule.run_pending()
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                registry.heartbeat("irrigation_system")
+                last_heartbeat = time.monotonic()
             time.sleep(1)  # Avoid busy waiting
     except KeyboardInterrupt:
         logging.info("Exiting irrigation system.")
         logging.info("Irrigation system stopped.")
+    finally:
+        controller.stop_all()
+        registry.publish("irrigation_system", "STOPPED")
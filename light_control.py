@@ -1,12 +1,15 @@
 import os
 import time
+import json
 from gpiozero import OutputDevice
-from datetime import datetime, time as dtime
+from datetime import datetime, timedelta, time as dtime
 import pytz
 import threading
 import signal
 import sys
 import logging
+from state_registry import get_registry, HEARTBEAT_INTERVAL
+import metrics
 
 # Relay GPIO pin configuration
 RELAY_CHANNEL = 9  # GPIO pin for the relay controlling the lights
@@ -17,7 +20,11 @@ LIGHT_ON_MINUTE = 10  # Minute to turn lights on
 LIGHT_OFF_HOUR = 8  # Hour to turn lights off (24-hour format)
 LIGHT_OFF_MINUTE = 0  # Minute to turn lights off (24-hour format)
 
-SLEEP_INTERVAL_LIGHT_CONTROL = 60  # Interval to check light status (in seconds)
+# Extra ON windows can be configured in light_schedule.json (reloaded on SIGHUP):
+# {"timezone": "Europe/Warsaw", "windows": [["20:10", "08:00"], ["12:00", "13:30"]]}
+SCHEDULE_FILE = "light_schedule.json"
+TIMEZONE = "Europe/Warsaw"
+MAX_SLEEP_LIGHT_CONTROL = 3600  # Re-plan at least this often to absorb clock changes (in seconds)
 
 # Set up logging for light control
 log_dir = "logs"
@@ -30,55 +37,170 @@ light_handler = logging.FileHandler(os.path.join(log_dir, "light_control.log"))
 light_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(funcName)s - %(message)s"))
 light_logger.addHandler(light_handler)
 
-# Status file path
-status_file_path = "/tmp/light_status.txt"
+relay_actuations = metrics.counter("pigarden_relay_actuations_total", "Relay switches, by relay and new state")
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
 
 # Light control relay setup using gpiozero
 light_relay = OutputDevice(RELAY_CHANNEL, active_high=False, initial_value=False)  # Relay OFF initially
+metrics.gauge("pigarden_light_on", "1 while the light relay is on").set_function(lambda: int(light_relay.value))
+
+
+# Current schedule: list of (on_time, off_time) windows and the timezone they are in.
+# A window with on_time > off_time runs overnight.
+light_windows = [(dtime(LIGHT_ON_HOUR, LIGHT_ON_MINUTE), dtime(LIGHT_OFF_HOUR, LIGHT_OFF_MINUTE))]
+light_timezone = pytz.timezone(TIMEZONE)
+
+# Set to wake the control loop and re-plan immediately
+reschedule_event = threading.Event()
+
+
+def is_light_on_at(local_time, windows):
+    """Return True if the wall-clock time of day falls inside any ON window."""
+    for on_time, off_time in windows:
+        if on_time <= off_time:  # Same-day schedule
+            if on_time <= local_time < off_time:
+                return True
+        elif local_time >= on_time or local_time < off_time:  # Overnight schedule
+            return True
+    return False
+
+
+def desired_state(now_utc, windows=None, tz=None):
+    """Whether the lights should be ON at an aware UTC datetime."""
+    windows = light_windows if windows is None else windows
+    tz = light_timezone if tz is None else tz
+    return is_light_on_at(now_utc.astimezone(tz).time().replace(tzinfo=None), windows)
+
+
+def localize_edge(tz, naive):
+    """
+    Aware local time of a window edge. In the hour repeated when DST ends the
+    standard-time instant is used; an edge in the hour skipped when DST starts
+    becomes the instant the clocks jump, the first valid time after it.
+    """
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=False)
+    except pytz.NonExistentTimeError:
+        # Search between the readings on either side of the jump for the first
+        # instant whose wall-clock time is not before the edge
+        low = tz.localize(naive, is_dst=True).astimezone(pytz.utc)
+        high = tz.localize(naive, is_dst=False).astimezone(pytz.utc)
+        while high - low > timedelta(seconds=1):
+            middle = low + (high - low) / 2
+            if middle.astimezone(tz).replace(tzinfo=None) >= naive:
+                high = middle
+            else:
+                low = middle
+        return high.replace(microsecond=0).astimezone(tz)
+
+
+def next_transition(now_utc, windows=None, tz=None):
+    """
+    Compute the next instant after now_utc at which the desired state changes.
+    Window edges are resolved in local time, so DST changes move them correctly.
+    An edge inside a skipped hour moves to the first valid time after it, so a
+    window lying entirely inside that hour does not run that day.
+    :return: (aware UTC datetime, state after the transition), or (None, state) if it never changes.
+    """
+    windows = light_windows if windows is None else windows
+    tz = light_timezone if tz is None else tz
+    current = desired_state(now_utc, windows, tz)
+    today = now_utc.astimezone(tz).date()
+
+    edges = set()
+    for day_offset in range(-1, 3):
+        day = today + timedelta(days=day_offset)
+        for on_time, off_time in windows:
+            for edge in (on_time, off_time):
+                edges.add(localize_edge(tz, datetime.combine(day, edge)).astimezone(pytz.utc))
+
+    for edge in sorted(edges):
+        if edge > now_utc:
+            state = desired_state(edge, windows, tz)
+            if state != current:
+                return edge, state
+    return None, current
+
+
+def apply_light_state(is_light_on):
+    """Switch the relay only if it is not already in the requested state."""
+    if is_light_on:
+        if not light_relay.value:  # Only turn on if it's off
+            light_relay.on()
+            relay_actuations.inc(relay="light", state="on")
+            set_light_status("ON")
+            light_logger.info("Lights turned ON.")
+    else:
+        if light_relay.value:  # Only turn off if it's on
+            light_relay.off()
+            relay_actuations.inc(relay="light", state="off")
+            set_light_status("OFF")
+            light_logger.info("Lights turned OFF.")
+
+
+def set_light_schedule(windows, timezone=None):
+    """
+    Replace the ON windows and re-plan the control loop immediately.
+    :param windows: List of ("HH:MM", "HH:MM") or (time, time) on/off pairs.
+    :param timezone: Optional timezone name for the windows.
+    """
+    global light_windows, light_timezone
+    parsed = []
+    for on_time, off_time in windows:
+        if isinstance(on_time, str):
+            on_time = datetime.strptime(on_time, "%H:%M").time()
+        if isinstance(off_time, str):
+            off_time = datetime.strptime(off_time, "%H:%M").time()
+        parsed.append((on_time, off_time))
+    if timezone is not None:
+        light_timezone = pytz.timezone(timezone)
+    light_windows = parsed
+    light_logger.info(f"Light schedule set to {[(a.strftime('%H:%M'), b.strftime('%H:%M')) for a, b in parsed]} ({light_timezone}).")
+    reschedule_event.set()
+
+
+def load_light_schedule(path=SCHEDULE_FILE):
+    """Load the schedule from a JSON file if it exists; keep the current one otherwise."""
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+        set_light_schedule(config["windows"], config.get("timezone"))
+    except Exception as e:
+        errors.inc(component="light_control")
+        light_logger.error(f"Error loading light schedule from {path}: {e}")
 
 
 def control_lights():
-    """Control the lights based on time."""
+    """Control the lights, sleeping until the next scheduled transition."""
     while True:
         try:
-            # Get current local time
-            local_time = datetime.now(pytz.timezone("Europe/Warsaw")).time()
-            light_on_time = dtime(LIGHT_ON_HOUR, LIGHT_ON_MINUTE)
-            light_off_time = dtime(LIGHT_OFF_HOUR, LIGHT_OFF_MINUTE)
-
-            # Determine if the lights should be ON
-            if light_on_time <= light_off_time:  # Same-day schedule
-                is_light_on = light_on_time <= local_time < light_off_time
-            else:  # Overnight schedule
-                is_light_on = local_time >= light_on_time or local_time < light_off_time
-
-            # Control the light relay
-            if is_light_on:
-                if not light_relay.value:  # Only turn on if it's off
-                    light_relay.on()
-                    set_light_status("ON")
-                    light_logger.info("Lights turned ON.")
+            now = datetime.now(pytz.utc)
+            apply_light_state(desired_state(now))
+            transition, state = next_transition(now)
+            if transition is None:
+                timeout = MAX_SLEEP_LIGHT_CONTROL
             else:
-                if light_relay.value:  # Only turn off if it's on
-                    light_relay.off()
-                    set_light_status("OFF")
-                    light_logger.info("Lights turned OFF.")
-
-            # Debugging log for time and state
-            #light_logger.debug(f"Local time: {local_time}, Light ON: {is_light_on}")
-
+                timeout = min((transition - now).total_seconds(), MAX_SLEEP_LIGHT_CONTROL)
+                light_logger.debug(f"Next transition to {'ON' if state else 'OFF'} at {transition.astimezone(light_timezone)}")
         except Exception as e:
+            errors.inc(component="light_control")
             light_logger.error(f"Error controlling lights: {e}")
+            timeout = MAX_SLEEP_LIGHT_CONTROL
 
-        time.sleep(SLEEP_INTERVAL_LIGHT_CONTROL)
+        if reschedule_event.wait(max(timeout, 0)):
+            reschedule_event.clear()
 
-def set_light_status(status, file_path=status_file_path):
-    """Set the light status in the temporary file."""
+def set_light_status(status):
+    """Publish the light status in the shared state registry."""
     try:
-        with open(file_path, "w") as f:
-            f.write(status)
+        get_registry().publish("light", status)
     except Exception as e:
-        light_logger.error(f"Error updating light status file: {e}")
+        errors.inc(component="light_control")
+        light_logger.error(f"Error publishing light status: {e}")
 
 def start_control_lights_thread():
     """Start the light control loop in a separate thread."""
@@ -89,11 +211,18 @@ def start_control_lights_thread():
 
 def turn_off_lights():
     """Turn off the lights manually."""
+    if light_relay.value:
+        relay_actuations.inc(relay="light", state="off")
     light_relay.off()
     set_light_status("OFF")
     light_logger.info("Lights turned OFF manually.")
 
 
+def reload_signal_handler(sig, frame):
+    """Reload the schedule file on SIGHUP."""
+    load_light_schedule()
+
+
 def signal_handler(sig, frame):
     """Handle cleanup when the process is terminated."""
     light_logger.info("Process terminated. Turning off lights and cleaning up.")
@@ -102,15 +231,21 @@ def signal_handler(sig, frame):
 
 
 if __name__ == "__main__":
+    set_light_status("OFF")  # Matches the relay's initial state; clears a stale entry
+    load_light_schedule()
+    metrics.serve_metrics("light_control")
+
     # Start the light control in a separate thread
     start_control_lights_thread()
 
     # Register signal handler for safe termination
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, reload_signal_handler)
 
     try:
         while True:
-            time.sleep(1)  # Keep the main thread alive
+            get_registry().heartbeat("light_control")
+            time.sleep(HEARTBEAT_INTERVAL)  # Keep the main thread alive
     except KeyboardInterrupt:
         light_logger.info("Script interrupted. Turning off lights and exiting.")
         turn_off_lights()
@@ -0,0 +1,238 @@
+import math
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default latency buckets (in seconds), from 1 ms up to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Each daemon serves its metrics on its own local port, at http://127.0.0.1:<port>/metrics
+METRICS_HOST = "127.0.0.1"
+METRICS_PORTS = {
+    "sensor_service": 9101,
+    "data_update": 9102,
+    "irrigation_system": 9103,
+    "light_control": 9104,
+    "web_server": 9105,
+}
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_logger = logging.getLogger('metrics')
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic count, optionally split by labels.
+    :param name: Metric name, e.g. pigarden_sensor_errors_total.
+    :param help: One-line description.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}  # label key -> count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        """(name, label key, value) of every series, for render()."""
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+
+class Gauge:
+    """
+    Current value that can go up and down, optionally split by labels.
+    A gauge with set_function is read when the metrics are rendered.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}  # label key -> value
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Report function() as the unlabelled value."""
+        self.function = function
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            samples = [(self.name, key, value) for key, value in sorted(self.values.items())]
+        if self.function is not None:
+            samples.append((self.name, (), self.function()))
+        return samples
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets, optionally split by labels.
+    :param buckets: Sorted upper bounds; an implicit +Inf bucket is added.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        series = self.values.get(_label_key(labels))
+        return 0 if series is None else sum(series[:-1])
+
+    def samples(self):
+        """Cumulative buckets, then sum and count, of every series."""
+        with self.lock:
+            values = sorted((key, list(series)) for key, series in self.values.items())
+        samples = []
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                samples.append((self.name + "_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+            samples.append((self.name + "_sum", key, series[-1]))
+            samples.append((self.name + "_count", key, cumulative))
+        return samples
+
+
+# Metrics of this process, by name
+registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name, help, **kwargs):
+    with _registry_lock:
+        metric = registry.get(name)
+        if metric is None:
+            metric = registry[name] = cls(name, help, **kwargs)
+        return metric
+
+
+def counter(name, help):
+    """Return the process-wide Counter called name, creating it on first use."""
+    return _get_or_create(Counter, name, help)
+
+
+def gauge(name, help):
+    """Return the process-wide Gauge called name, creating it on first use."""
+    return _get_or_create(Gauge, name, help)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    """Return the process-wide Histogram called name, creating it on first use."""
+    return _get_or_create(Histogram, name, help, buckets=buckets)
+
+
+def render():
+    """Every metric of this process in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would flood the logs
+
+
+def serve_metrics(process, host=METRICS_HOST):
+    """
+    Serve render() at http://<host>:<port>/metrics from a daemon thread, on the
+    port METRICS_PORTS lists for process. A busy port is logged, not raised, so
+    the daemon keeps running without its endpoint.
+    :return: The server, or None if it could not be started.
+    """
+    try:
+        server = ThreadingHTTPServer((host, METRICS_PORTS[process]), MetricsHandler)
+    except OSError as e:
+        metrics_logger.error(f"Cannot serve {process} metrics on port {METRICS_PORTS[process]}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,202 @@
+import os
+import ssl
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import urllib.error
+import urllib.request
+from rollups import METRICS
+from compact_schema import is_compact
+import metrics
+
+# Constants
+DB_PATH = "sensor_data.db"
+HUB_FILE = "hub.json"
+PUSH_INTERVAL = 60  # Push new readings this often (in seconds)
+BATCH_ROWS = 500  # Readings per request
+REQUEST_TIMEOUT = 30  # Give up on a request after this long (in seconds)
+RETRY_BACKOFF = 5  # First wait after a failed push, doubled per failure (in seconds)
+MAX_BACKOFF = 900  # Longest wait between failed pushes (in seconds)
+GZIP_LEVEL = 6  # Compression level of the pushed batches
+
+# Hub mode is configured in hub.json. A node pushes its readings to a collector:
+# {"node_id": "greenhouse", "collector_url": "https://hub.example.org/api/ingest", "token": "secret"}
+# ("ca_file" trusts a private CA). A collector (see collector.py) accepts nodes listed in
+# {"collector": {"fleet_dir": "fleet", "tokens": {"greenhouse": "secret"}}}
+DEFAULT_HUB = {
+    "node_id": None,
+    "collector_url": None,
+    "token": None,
+    "ca_file": None,
+    "batch_rows": BATCH_ROWS,
+    "interval": PUSH_INTERVAL,
+    "collector": None,
+}
+
+# Columns of a pushed row; 'time' is the Unix time, or the local timestamp text
+# for a database not yet converted by compact_schema.py
+PUSH_COLUMNS = ("id", "time") + METRICS
+
+# What the ids of a push are: autoincrement ids of a legacy table, or in the
+# compact layout Unix times. compact_schema.py converts the cursors when it
+# switches a node over. Readings written while the clock was behind get ids
+# below the cursor and are not pushed; replication.py --rewind sends them.
+KEYS = ("id", "time")
+
+replication_logger = logging.getLogger('data_update')
+
+rows_pushed = metrics.counter("pigarden_replication_rows_total", "Readings acknowledged by the hub collector")
+push_latency = metrics.histogram("pigarden_replication_push_seconds", "Duration of one push request to the collector")
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
+
+
+def load_hub_config(path=HUB_FILE):
+    """Return DEFAULT_HUB updated with the settings in path, if it exists."""
+    config = dict(DEFAULT_HUB)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            config.update(json.load(f))
+    return config
+
+
+def get_cursor(conn, peer):
+    """Last id acknowledged by (on a collector: received from) peer, 0 if none yet."""
+    row = conn.execute("SELECT last_id FROM replication_state WHERE peer = ?", (peer,)).fetchone()
+    return row[0] if row else 0
+
+
+def set_cursor(conn, peer, last_id, expected=None):
+    """
+    Store the cursor of peer.
+    :param expected: If given, only replace a cursor that still holds this id, so a
+                     cursor converted by compact_schema.py during a push is kept.
+    :return: True if the cursor was stored.
+    """
+    sql = ("INSERT INTO replication_state (peer, last_id, updated_at) VALUES (?, ?, ?) "
+           "ON CONFLICT(peer) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at")
+    params = (peer, last_id, time.time())
+    if expected is not None:
+        sql += " WHERE last_id = ?"
+        params += (expected,)
+    with conn:
+        return conn.execute(sql, params).rowcount > 0
+
+
+def read_delta(conn, after, limit=BATCH_ROWS):
+    """Readings with id > after, oldest first, as lists in PUSH_COLUMNS order."""
+    # In the compact layout the id is the Unix time
+    time_column = "id" if is_compact(conn) else "timestamp"
+    rows = conn.execute(
+        f"SELECT id, {time_column}, {', '.join(METRICS)} FROM sensor_readings WHERE id > ? ORDER BY id LIMIT ?",
+        (after, limit),
+    ).fetchall()
+    return [list(row) for row in rows]
+
+
+def encode_batch(node_id, after, rows, key="id"):
+    """Gzip-compressed JSON body of one push; key is one of KEYS."""
+    payload = {"node": node_id, "after": after, "key": key, "columns": PUSH_COLUMNS, "rows": rows}
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode(), GZIP_LEVEL)
+
+
+def post_batch(config, body):
+    """
+    Send one batch to the collector.
+    :return: The id the collector has acknowledged.
+    """
+    request = urllib.request.Request(config["collector_url"], data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+        "Authorization": f"Bearer {config['token']}",
+    })
+    context = ssl.create_default_context(cafile=config["ca_file"]) if config["ca_file"] else None
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT, context=context) as response:
+        return int(json.load(response)["acknowledged"])
+
+
+def push_once(config, db_path=DB_PATH):
+    """
+    Push everything not yet acknowledged, one batch per request. The cursor only
+    moves to what the collector acknowledges, so after a failure the next push
+    resumes there; a collector that lost data answers with an older id and the
+    missing rows are sent again.
+    :return: Number of rows pushed.
+    """
+    peer = config["collector_url"]
+    conn = sqlite3.connect(db_path)
+    try:
+        pushed = 0
+        while True:
+            after = get_cursor(conn, peer)
+            rows = read_delta(conn, after, config["batch_rows"])
+            if not rows:
+                return pushed
+            key = "time" if is_compact(conn) else "id"
+            with push_latency.time():
+                acknowledged = post_batch(config, encode_batch(config["node_id"], after, rows, key))
+            if acknowledged == after:
+                raise ValueError(f"Collector did not accept readings after id {after}")
+            if not set_cursor(conn, peer, acknowledged, expected=after):
+                replication_logger.info("Replication cursor changed during the push; continuing from the new one.")
+                continue
+            if acknowledged < rows[-1][0]:
+                replication_logger.warning(f"Collector acknowledged id {acknowledged} of {rows[-1][0]}; resending from there.")
+            else:
+                pushed += len(rows)
+                rows_pushed.inc(len(rows))
+    finally:
+        conn.close()
+
+
+def rewind(config, seconds, db_path=DB_PATH):
+    """
+    Move the cursor back by seconds, so readings stored with an earlier time than
+    the last pushed one (after the clock was corrected backwards) are pushed.
+    The collector keeps the readings it already holds.
+    :return: The new cursor.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if not is_compact(conn):
+            raise RuntimeError("Rewinding needs the compact layout, where ids are Unix times")
+        last_id = max(get_cursor(conn, config["collector_url"]) - seconds, 0)
+        set_cursor(conn, config["collector_url"], last_id)
+        return last_id
+    finally:
+        conn.close()
+
+
+def replication_loop(config, db_path=DB_PATH):
+    """Push new readings every config['interval'] seconds, backing off while the collector is unreachable."""
+    backoff = RETRY_BACKOFF
+    while True:
+        try:
+            pushed = push_once(config, db_path)
+            if pushed:
+                replication_logger.info(f"Pushed {pushed} readings to {config['collector_url']}.")
+            backoff = RETRY_BACKOFF
+            time.sleep(config["interval"])
+        except (OSError, urllib.error.URLError, ValueError, KeyError, sqlite3.Error) as e:
+            errors.inc(component="replication")
+            replication_logger.error(f"Error pushing readings, retrying in {backoff} s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Push new readings to the hub collector")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--config", default=HUB_FILE, help="Hub configuration JSON file")
+    parser.add_argument("--rewind", type=int, metavar="SECONDS",
+                        help="First move the cursor back this far, to push readings stored while the clock was behind")
+    args = parser.parse_args()
+    hub = load_hub_config(args.config)
+    if not hub["collector_url"] or not hub["node_id"]:
+        parser.error(f"Set node_id and collector_url in {args.config}")
+    if args.rewind:
+        print(f"Cursor moved back to {rewind(hub, args.rewind, args.db)}.")
+    print(f"Pushed {push_once(hub, args.db)} readings.")
@@ -0,0 +1,206 @@
+import os
+import csv
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+import pytz
+
+# Constants
+DB_PATH = "sensor_data.db"
+POLICY_FILE = "retention.json"
+ARCHIVE_DIR = "archive"
+BATCH_ROWS = 500  # Rows deleted per transaction
+BATCH_PAUSE = 0.05  # Pause between transactions so writers get the lock (in seconds)
+VACUUM_PAGES = 256  # Free pages returned to the filesystem per incremental vacuum step
+BUSY_TIMEOUT = 5000  # Wait this long for a writer to finish (in milliseconds)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMEZONE = pytz.timezone("Europe/Warsaw")
+
+# Days each table is kept; None keeps it forever. Override any of them in retention.json:
+# {"sensor_readings": 30, "sensor_rollup_hour": 730}
+DEFAULT_POLICY = {
+    "sensor_readings": 30,
+    "sensor_raw_samples": 30,
+    "sensor_rollup_minute": 30,
+    "sensor_rollup_hour": 730,
+    "sensor_aggregates": 730,
+    "sensor_rollup_day": None,
+    "sensor_events": None,
+}
+
+# How expired rows are found: table -> (time column, whether it holds Unix time rather
+# than a local timestamp, unique column of archived tables or None to delete without archiving)
+TABLES = {
+    "sensor_readings": ("timestamp", False, "id"),
+    "sensor_raw_samples": ("time", True, "time"),
+    "sensor_rollup_minute": ("bucket", False, None),
+    "sensor_rollup_hour": ("bucket", False, None),
+    "sensor_rollup_day": ("bucket", False, None),
+    "sensor_aggregates": ("bucket", False, None),
+    "sensor_events": ("timestamp", False, None),
+    "readings": ("time", True, "time"),
+}
+
+# Tables that keep the policy of a view replacing them (see compact_schema.py)
+COMPACT_TABLES = {"sensor_readings": "readings"}
+
+retention_logger = logging.getLogger('retention')
+
+
+def load_policy(path=POLICY_FILE):
+    """Return DEFAULT_POLICY updated with the retention days in path, if it exists."""
+    policy = dict(DEFAULT_POLICY)
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                policy.update(json.load(f))
+        except (OSError, ValueError) as e:
+            retention_logger.error(f"Error loading retention policy from {path}: {e}")
+    return policy
+
+
+def cutoff(days, now=None):
+    """
+    Oldest time still retained for a table kept `days` days.
+    :return: (local 'YYYY-MM-DD HH:MM:SS' string, Unix time)
+    """
+    now = time.time() if now is None else now
+    oldest = now - days * 86400
+    return datetime.fromtimestamp(oldest, TIMEZONE).strftime(TIMESTAMP_FORMAT), oldest
+
+
+def _archive_month(key, is_epoch):
+    if is_epoch:
+        return datetime.fromtimestamp(key, TIMEZONE).strftime("%Y-%m")
+    return key[:7]
+
+
+def archive_rows(table, columns, rows, is_epoch, archive_dir=ARCHIVE_DIR):
+    """
+    Append rows to gzip-compressed monthly CSV files, archive/<table>-YYYY-MM.csv.gz.
+    Each call adds a gzip member; gzip readers return the members as one stream.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    key_index = columns.index(TABLES[table][0])
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(_archive_month(row[key_index], is_epoch), []).append(row)
+    for month, month_rows in by_month.items():
+        path = os.path.join(archive_dir, f"{table}-{month}.csv.gz")
+        new_file = not os.path.exists(path)
+        with gzip.open(path, "at", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(columns)
+            writer.writerows(month_rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def expire_table(conn, table, days, batch_rows=BATCH_ROWS, pause=BATCH_PAUSE, archive_dir=ARCHIVE_DIR, now=None):
+    """
+    Delete rows older than `days` in transactions of at most batch_rows rows,
+    archiving them first for archived tables. An archive chunk is written before
+    its rows are deleted, so a crash in between can only duplicate rows in the archive.
+    :return: Number of rows deleted.
+    """
+    key, is_epoch, unique = TABLES[table]
+    oldest_text, oldest_epoch = cutoff(days, now)
+    oldest = oldest_epoch if is_epoch else oldest_text
+    deleted = 0
+    while True:
+        with conn:
+            cursor = conn.execute(
+                f"SELECT * FROM {table} WHERE {key} < ? ORDER BY {key} LIMIT ?", (oldest, batch_rows))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            columns = [description[0] for description in cursor.description]
+            if unique is not None:
+                # Delete exactly the archived rows
+                archive_rows(table, columns, rows, is_epoch, archive_dir)
+                index = columns.index(unique)
+                conn.executemany(f"DELETE FROM {table} WHERE {unique} = ?", [(row[index],) for row in rows])
+                deleted += len(rows)
+            else:
+                # Rows sharing the last key are all removed, so the next batch starts after it
+                last_key = rows[-1][columns.index(key)]
+                deleted += conn.execute(f"DELETE FROM {table} WHERE {key} <= ? AND {key} < ?",
+                                        (last_key, oldest)).rowcount
+        time.sleep(pause)
+    return deleted
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES, pause=BATCH_PAUSE):
+    """
+    Return free pages to the filesystem in small steps.
+    :return: Number of pages released, or None when auto_vacuum is not INCREMENTAL.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    released = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return released
+        # executescript steps the pragma to completion; execute would free one page per call
+        conn.executescript(f"PRAGMA incremental_vacuum({pages});")
+        released += min(free, pages)
+        time.sleep(pause)
+
+
+def enable_incremental_vacuum(db_path=DB_PATH):
+    """One-off switch of an existing database to auto_vacuum=INCREMENTAL; runs a full VACUUM."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def run_retention(db_path=DB_PATH, policy=None, archive_dir=ARCHIVE_DIR, batch_rows=BATCH_ROWS, now=None):
+    """
+    Apply the retention policy to every table, then release freed pages.
+    :return: Dict of table -> rows deleted.
+    """
+    policy = load_policy() if policy is None else policy
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT / 1000)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+        existing = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')"))
+        results = {}
+        for table, days in policy.items():
+            if existing.get(table) == "view":
+                table = COMPACT_TABLES.get(table, table)
+            if days is None or table not in TABLES or existing.get(table) != "table":
+                continue
+            results[table] = expire_table(conn, table, days, batch_rows, archive_dir=archive_dir, now=now)
+            if results[table]:
+                retention_logger.info(f"Expired {results[table]} rows older than {days} days from {table}.")
+        released = incremental_vacuum(conn)
+        if released is None:
+            retention_logger.info("auto_vacuum is not INCREMENTAL; run `python3 retention.py --enable-incremental-vacuum` once.")
+        elif released:
+            retention_logger.info(f"Released {released} free pages.")
+        return results
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Expire, archive and compact old sensor data")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--policy", default=POLICY_FILE, help="Retention policy JSON file")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="Directory for the monthly archives")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Switch an existing database to incremental vacuum (one full VACUUM)")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(args.db)
+    print(run_retention(args.db, load_policy(args.policy), args.archive_dir))
@@ -0,0 +1,126 @@
+import sqlite3
+import argparse
+
+DB_PATH = "sensor_data.db"
+BACKFILL_CHUNK = 10000  # Raw rows aggregated per backfill transaction
+
+# Metric columns of sensor_readings that are rolled up
+METRICS = ("temperature", "humidity", "soil_moisture", "cpu_temperature", "lux")
+
+# Rollup resolutions, finest first: table, SQL expression giving the bucket
+# start for a row's timestamp, and bucket length in seconds
+RESOLUTIONS = {
+    "minute": ("sensor_rollup_minute", "substr(timestamp, 1, 16) || ':00'", 60),
+    "hour": ("sensor_rollup_hour", "substr(timestamp, 1, 13) || ':00:00'", 3600),
+    "day": ("sensor_rollup_day", "substr(timestamp, 1, 10) || ' 00:00:00'", 86400),
+}
+
+
+def bucket_start(timestamp, resolution):
+    """Python twin of the RESOLUTIONS bucket expressions for a 'YYYY-MM-DD HH:MM:SS' string."""
+    if resolution == "minute":
+        return timestamp[:16] + ":00"
+    if resolution == "hour":
+        return timestamp[:13] + ":00:00"
+    return timestamp[:10] + " 00:00:00"
+
+
+def _upsert_sql(resolution):
+    table, bucket_expr, _ = RESOLUTIONS[resolution]
+    selects = " UNION ALL ".join(
+        f"SELECT {bucket_expr} AS bucket, '{metric}' AS metric, MIN({metric}) AS min, MAX({metric}) AS max, "
+        f"SUM({metric}) AS sum, COUNT({metric}) AS count FROM sensor_readings "
+        f"WHERE id BETWEEN :first_id AND :last_id AND {metric} IS NOT NULL GROUP BY 1"
+        for metric in METRICS
+    )
+    # The outer WHERE keeps SQLite from parsing ON CONFLICT as a join constraint
+    return f"""
+        INSERT INTO {table} (bucket, metric, min, max, sum, count)
+        SELECT * FROM ({selects}) WHERE true
+        ON CONFLICT (bucket, metric) DO UPDATE SET
+            min = MIN({table}.min, excluded.min),
+            max = MAX({table}.max, excluded.max),
+            sum = {table}.sum + excluded.sum,
+            count = {table}.count + excluded.count
+    """
+
+
+def _peaks_sql(resolution):
+    table, bucket_expr, _ = RESOLUTIONS[resolution]
+    # Readings are interval means, so their min/max miss the peaks; the bucket of
+    # each row also gets the min/max of the sensor_aggregates interval it falls in
+    return f"""
+        UPDATE {table} SET
+            min = COALESCE(MIN({table}.min, peaks.min), {table}.min),
+            max = COALESCE(MAX({table}.max, peaks.max), {table}.max)
+        FROM (
+            SELECT {bucket_expr} AS bucket, a.metric, MIN(a.min) AS min, MAX(a.max) AS max
+            FROM sensor_readings
+            JOIN sensor_aggregates a
+              ON a.bucket = (SELECT MAX(bucket) FROM sensor_aggregates WHERE bucket <= timestamp)
+             AND a.bucket > datetime(timestamp, '-' || a.seconds || ' seconds')
+            WHERE id BETWEEN :first_id AND :last_id
+            GROUP BY 1, 2
+        ) AS peaks
+        WHERE {table}.bucket = peaks.bucket AND {table}.metric = peaks.metric
+    """
+
+
+UPSERT_SQL = {resolution: _upsert_sql(resolution) for resolution in RESOLUTIONS}
+PEAKS_SQL = {resolution: _peaks_sql(resolution) for resolution in RESOLUTIONS}
+
+
+def update_rollups(conn, first_id, last_id):
+    """
+    Fold the raw rows with ids in [first_id, last_id] into every rollup table,
+    widening min/max to the sensor_aggregates peaks of the same buckets.
+    Runs inside the caller's transaction so rows and rollups commit together.
+    """
+    params = {"first_id": first_id, "last_id": last_id}
+    for resolution in RESOLUTIONS:
+        conn.execute(UPSERT_SQL[resolution], params)
+        conn.execute(PEAKS_SQL[resolution], params)
+
+
+def backfill(db_path=DB_PATH, chunk=BACKFILL_CHUNK):
+    """
+    Rebuild the rollup tables from sensor_readings in small transactions.
+    Buckets older than the oldest raw row are kept, since retention may already
+    have expired their raw rows. Rows inserted after the rebuild starts are left
+    to the writer's incremental updates.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            first_id, last_id = conn.execute(
+                "SELECT COALESCE(MIN(id), 1), COALESCE(MAX(id), 0) FROM sensor_readings").fetchone()
+            oldest = conn.execute("SELECT timestamp FROM sensor_readings WHERE id = ?", (first_id,)).fetchone()
+            oldest = oldest[0] if oldest else None
+            if oldest is not None:
+                # Buckets before the oldest raw row may only survive in the rollups (see retention.py)
+                for resolution, (table, _, _) in RESOLUTIONS.items():
+                    conn.execute(f"DELETE FROM {table} WHERE bucket >= ?", (bucket_start(oldest, resolution),))
+
+        while first_id <= last_id:
+            # Ids are sparse Unix times in the compact layout, so chunks end at the chunk-th row
+            chunk_end = conn.execute(
+                "SELECT id FROM sensor_readings WHERE id >= ? ORDER BY id LIMIT 1 OFFSET ?",
+                (first_id, chunk - 1)).fetchone()
+            chunk_end = last_id if chunk_end is None else min(chunk_end[0], last_id)
+            with conn:
+                update_rollups(conn, first_id, chunk_end)
+            print(f"Rolled up rows {first_id}-{chunk_end} of {last_id}")
+            first_id = chunk_end + 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain sensor_readings rollup tables")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild rollups from all existing rows")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database")
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(args.db)
+    else:
+        parser.print_help()
@@ -0,0 +1,69 @@
+import numpy as np
+from rollups import METRICS
+
+AGGREGATES = ("min", "max", "mean", "last", "count")
+
+
+class SampleRing:
+    """
+    Fixed-size in-memory ring of timestamped samples, one float64 column per
+    metric (NaN for a missing reading). Once full, the oldest samples are overwritten.
+    :param capacity: Number of samples kept.
+    :param metrics: Metric names, in column order.
+    """
+
+    def __init__(self, capacity, metrics=METRICS):
+        self.capacity = capacity
+        self.metrics = tuple(metrics)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, len(self.metrics)), np.nan, dtype=np.float64)
+        self.next = 0  # Slot the next sample is written to
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, sample):
+        """
+        Store one sample.
+        :param timestamp: Unix time of the sample.
+        :param sample: Dict of metric -> value; missing or None values are stored as NaN.
+        """
+        self.times[self.next] = timestamp
+        self.values[self.next] = [np.nan if sample.get(metric) is None else sample[metric]
+                                  for metric in self.metrics]
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def window(self, start, end):
+        """
+        Samples with start <= timestamp < end, oldest first.
+        :return: (times, values) arrays; values has one column per metric.
+        """
+        order = np.roll(np.arange(self.capacity), -self.next)[self.capacity - self.size:]
+        times = self.times[order]
+        mask = (times >= start) & (times < end)
+        return times[mask], self.values[order][mask]
+
+    def aggregate(self, start, end):
+        """
+        Summarize each metric over [start, end).
+        :return: Dict of metric -> dict with min, max, mean, last and count; NaN
+                 readings are skipped and statistics of an empty metric are None.
+        """
+        _, values = self.window(start, end)
+        result = {}
+        for column, metric in enumerate(self.metrics):
+            column_values = values[:, column]
+            valid = column_values[~np.isnan(column_values)]
+            if len(valid):
+                result[metric] = {
+                    'min': float(valid.min()),
+                    'max': float(valid.max()),
+                    'mean': round(float(valid.mean()), 3),
+                    'last': float(valid[-1]),
+                    'count': int(len(valid)),
+                }
+            else:
+                result[metric] = {'min': None, 'max': None, 'mean': None, 'last': None, 'count': 0}
+        return result
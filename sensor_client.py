@@ -0,0 +1,36 @@
+import json
+import time
+import socket
+
+# Unix socket the sensor service publishes its latest snapshot on
+SOCKET_PATH = "/tmp/pigarden_sensors.sock"
+
+
+def get_snapshot(socket_path=SOCKET_PATH, max_age=None, timeout=1.0):
+    """
+    Fetch the latest sensor snapshot from the sensor service.
+    :param socket_path: Unix socket of the sensor service.
+    :param max_age: If set, snapshots older than this many seconds are ignored.
+    :param timeout: Socket timeout in seconds.
+    :return: Snapshot dict, or None if the service is unavailable or the data is stale.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            chunks = []
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        return None
+
+    payload = b"".join(chunks)
+    if not payload:
+        return None  # Service is up but has not taken its first sample yet
+    snapshot = json.loads(payload)
+    if max_age is not None and time.time() - snapshot['timestamp'] > max_age:
+        return None
+    return snapshot
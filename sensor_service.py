@@ -0,0 +1,189 @@
+import os
+import time
+import json
+import signal
+import logging
+import argparse
+import threading
+import socketserver
+from sensor_utils import (
+    scan_soil_channels,
+    configured_soil_channels,
+    SOIL_SAMPLES,
+    SOIL_SAMPLE_DELAY,
+    SOIL_FILTER,
+    get_cpu_temperature,
+    start_sht31_measurement,
+    collect_sht31_measurement,
+    start_sht31_periodic,
+    fetch_sht31_periodic,
+    stop_sht31_periodic,
+    PERIODIC_COMMANDS,
+    read_lux_sample,
+)
+from sensor_client import SOCKET_PATH
+import metrics
+from state_registry import get_registry
+
+# Constants
+SAMPLE_INTERVAL = 1  # Default interval between sensor samples (in seconds)
+SOIL_CHANNEL = 0  # ADC channel reported as the main soil moisture reading
+# All ADC channels with a soil probe (one per irrigation zone): those in soil_calibration.json
+SOIL_CHANNELS = sorted(set(configured_soil_channels()) | {SOIL_CHANNEL})
+
+# Burst settings for soil reads, overridable from the command line
+soil_burst = {'samples': SOIL_SAMPLES, 'delay': SOIL_SAMPLE_DELAY, 'method': SOIL_FILTER}
+# Auto-range the VEML7700 gain and integration time; False keeps gain 1/8 and 100 ms
+lux_auto_range = True
+# SHT31 periodic acquisition rate (measurements per second), or None for single shots
+sht31_periodic = None
+
+# Set up logging
+log_dir = "logs"
+log_file = f"{log_dir}/sensor_service.log"
+if not os.path.exists(log_dir):
+    os.makedirs(log_dir)
+
+service_logger = logging.getLogger('sensor_service')
+service_logger.setLevel(logging.INFO)
+
+# Create a file handler to write logs to the file
+file_handler = logging.FileHandler(log_file)
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+service_logger.addHandler(file_handler)
+
+snapshot_latency = metrics.histogram("pigarden_snapshot_seconds", "Duration of a full sensor snapshot")
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
+
+# Latest snapshot, pre-encoded so serving a client is a single send
+latest_snapshot = b""
+
+
+def take_snapshot(seq):
+    """
+    Read every sensor once and return a timestamped snapshot dict. The SHT31
+    conversion is started first and collected last, so the soil, CPU and lux
+    reads run while it converts. A sensor that cannot be read is reported as None.
+    """
+    started = time.monotonic()
+    sht31_ready = None if sht31_periodic else start_sht31_measurement()
+    soil_channels = {str(channel): None for channel in SOIL_CHANNELS}
+    soil_variance = dict(soil_channels)
+    try:
+        for channel, (value, variance) in scan_soil_channels(SOIL_CHANNELS, **soil_burst).items():
+            soil_channels[str(channel)] = value
+            soil_variance[str(channel)] = variance
+    except Exception as e:
+        # The other sensors are still published; the soil fields stay None
+        service_logger.error(f"Error reading soil moisture: {e}")
+    cpu_temperature = get_cpu_temperature()
+    lux_sample = read_lux_sample(lux_auto_range) or {}
+    if sht31_periodic:
+        temperature, humidity = fetch_sht31_periodic()
+    else:
+        temperature, humidity = collect_sht31_measurement(sht31_ready)
+    return {
+        'seq': seq,
+        'timestamp': time.time(),
+        'soil_moisture': soil_channels[str(SOIL_CHANNEL)],
+        'soil_channels': soil_channels,  # Keyed by channel number as a string (JSON keys)
+        'soil_variance': soil_variance,  # Variance of each channel's burst (in %^2)
+        'temperature': temperature,
+        'humidity': humidity,
+        'cpu_temperature': cpu_temperature,
+        'lux': lux_sample.get('lux'),
+        'lux_gain': lux_sample.get('gain'),  # VEML7700 settings used for this lux reading
+        'lux_integration_ms': lux_sample.get('integration_ms'),
+        'lux_saturated': lux_sample.get('saturated'),  # True if lux is only a lower bound
+        'sample_time': round(time.monotonic() - started, 4),  # Snapshot acquisition latency (in seconds)
+    }
+
+
+def sample_loop(interval, stop_event):
+    """Sample the sensors every `interval` seconds and publish the result."""
+    global latest_snapshot
+    seq = 0
+    next_sample = time.monotonic()
+    while not stop_event.is_set():
+        seq += 1
+        try:
+            snapshot = take_snapshot(seq)
+            snapshot_latency.observe(snapshot['sample_time'])
+            latest_snapshot = (json.dumps(snapshot) + "\n").encode()
+            get_registry().heartbeat("sensor_service")
+        except Exception as e:
+            errors.inc(component="sensor_service")
+            service_logger.error(f"Error taking sensor snapshot: {e}")
+        next_sample += interval
+        stop_event.wait(max(0.0, next_sample - time.monotonic()))
+
+
+class SnapshotHandler(socketserver.BaseRequestHandler):
+    """Send the latest snapshot as one JSON line and close the connection."""
+
+    def handle(self):
+        self.request.sendall(latest_snapshot)
+
+
+class SnapshotServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(interval=SAMPLE_INTERVAL, socket_path=SOCKET_PATH):
+    """Run the sampling loop and serve snapshots on a Unix socket until SIGTERM."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = SnapshotServer(socket_path, SnapshotHandler)
+    os.chmod(socket_path, 0o666)
+
+    if sht31_periodic:
+        start_sht31_periodic(sht31_periodic)
+    metrics.serve_metrics("sensor_service")
+
+    stop_event = threading.Event()
+    sampler = threading.Thread(target=sample_loop, args=(interval, stop_event), daemon=True)
+    sampler.start()
+
+    def signal_handler(sig, frame):
+        service_logger.info("Process terminated. Stopping sensor service.")
+        stop_event.set()
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, signal_handler)
+    service_logger.info(f"Sensor service started, sampling every {interval} s on {socket_path}.")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        server.server_close()
+        if sht31_periodic:
+            stop_sht31_periodic()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        service_logger.info("Sensor service stopped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PiGarden sensor acquisition service")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL,
+                        help="Seconds between sensor samples")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket path to publish on")
+    parser.add_argument("--soil-samples", type=int, default=SOIL_SAMPLES, help="ADC samples per soil reading")
+    parser.add_argument("--soil-delay", type=float, default=SOIL_SAMPLE_DELAY,
+                        help="Seconds between samples in a soil burst")
+    parser.add_argument("--soil-filter", choices=["median", "trimmed", "mean"], default=SOIL_FILTER,
+                        help="Filter applied to each soil burst")
+    parser.add_argument("--sht31-periodic", type=float, choices=sorted(PERIODIC_COMMANDS),
+                        help="Run the SHT31 in periodic acquisition mode at this many measurements per second")
+    parser.add_argument("--lux-fixed", action="store_true",
+                        help="Keep the VEML7700 at gain 1/8 and 100 ms instead of auto-ranging")
+    args = parser.parse_args()
+    if args.soil_samples < 1:
+        parser.error("--soil-samples must be at least 1")
+    lux_auto_range = not args.lux_fixed
+    soil_burst.update(samples=args.soil_samples, delay=args.soil_delay, method=args.soil_filter)
+    sht31_periodic = args.sht31_periodic
+    serve(args.interval, args.socket)
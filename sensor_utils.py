@@ -1,22 +1,57 @@
 import os
 import time
-import board
-import adafruit_veml7700
+import json
 import logging
-from smbus2 import SMBus
+import statistics
 from datetime import datetime
+import metrics
+from i2c_bus import bus_session, sht31_crc, FakeVEML7700, FAKE_BUS_ENV
+from state_registry import get_registry
 
 veml7700 = None
+soil_calibration = None  # channel -> (dry, wet) raw ADC values, loaded on first use
+lux_range = None  # Index in LUX_RANGES currently set on the VEML7700
+lux_ready_at = 0.0  # time.monotonic() at which a reading with the current settings is available
 
 # Constants
 ADC_ADDRESS = 0x48  # I2C address for ADC
 DRY_SOIL_ADC = 240  # ADC value for dry soil
 WET_SOIL_ADC = 76  # ADC value for wet soil
+# Per-channel calibration written by helper_script/soil_calibration.py:
+# {"channels": {"0": {"dry": 240, "wet": 76}, "1": {"dry": 193, "wet": 100}}}
+# Channels missing from the file use DRY_SOIL_ADC and WET_SOIL_ADC.
+CALIBRATION_FILE = "soil_calibration.json"
+SOIL_SAMPLES = 9  # Samples per burst read of a soil channel
+SOIL_SAMPLE_DELAY = 0.001  # Delay between samples in a burst (in seconds)
+SOIL_FILTER = "median"  # Burst filter: median, trimmed or mean
+TRIM_FRACTION = 0.2  # Fraction of samples dropped from each end by the trimmed filter
 SHT31_ADDRESS = 0x44
-TEMP_COMMAND = [0x2C, 0x06]
-
-# Status file path
-status_file_path = "/tmp/light_status.txt"
+SINGLE_SHOT_COMMAND = [0x24, 0x00]  # High repeatability single shot without clock stretching
+SHT31_CONVERSION_TIME = 0.016  # Worst-case high repeatability conversion (in seconds)
+# Periodic acquisition commands (high repeatability) by measurements per second
+PERIODIC_COMMANDS = {0.5: [0x20, 0x32], 1: [0x21, 0x30], 2: [0x22, 0x36], 4: [0x23, 0x34], 10: [0x27, 0x37]}
+FETCH_COMMAND = [0xE0, 0x00]
+BREAK_COMMAND = [0x30, 0x93]  # Stops periodic acquisition
+# VEML7700 settings from least to most sensitive: (gain attribute, gain, integration attribute, ms)
+LUX_RANGES = [
+    ("ALS_GAIN_1_8", 0.125, "ALS_25MS", 25),
+    ("ALS_GAIN_1_8", 0.125, "ALS_50MS", 50),
+    ("ALS_GAIN_1_8", 0.125, "ALS_100MS", 100),
+    ("ALS_GAIN_1_4", 0.25, "ALS_100MS", 100),
+    ("ALS_GAIN_1", 1, "ALS_100MS", 100),
+    ("ALS_GAIN_2", 2, "ALS_100MS", 100),
+    ("ALS_GAIN_2", 2, "ALS_200MS", 200),
+    ("ALS_GAIN_2", 2, "ALS_400MS", 400),
+    ("ALS_GAIN_2", 2, "ALS_800MS", 800),
+]
+LUX_FIXED_RANGE = 2  # Gain 1/8 and 100 ms, used when auto-ranging is off
+LUX_MAX_RESOLUTION = 0.0036  # lx per count at gain 2 and 800 ms
+LUX_TARGET_COUNTS = 1000  # Auto-ranging picks the fastest setting expected to reach this count
+LUX_MIN_COUNTS = 100  # Fewer counts are too coarse; the reading is re-taken more sensitively
+LUX_MAX_COUNTS = 10000  # More counts are non-linear or saturated; the reading is re-taken less sensitively
+LUX_MAX_RERANGES = 2  # Extra reads per sample when the count is out of range
+READ_ATTEMPTS = 3  # Attempts per sensor read before giving up
+RETRY_BACKOFF = 0.005  # Delay before the first retry, doubled for each further one (in seconds)
 
 # Set up logging for sensor utils
 log_dir = "logs"
@@ -32,6 +67,45 @@ file_handler = logging.FileHandler(log_file)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 sensor_logger.addHandler(file_handler)
 
+# Per-sensor error counters and latency histograms
+read_errors = metrics.counter("pigarden_sensor_errors_total", "Failed sensor read attempts by sensor and error type")
+read_failures = metrics.counter("pigarden_sensor_failures_total", "Sensor reads that failed after every retry")
+read_latency = metrics.histogram("pigarden_sensor_read_seconds", "Duration of successful sensor reads, including retries")
+
+
+class SensorCRCError(ValueError):
+    """A sensor returned data whose checksum does not match."""
+
+
+def _error_kind(error):
+    if isinstance(error, SensorCRCError):
+        return "crc"
+    return "io" if isinstance(error, OSError) else "other"
+
+def with_retries(sensor, read, attempts=READ_ATTEMPTS, backoff=RETRY_BACKOFF, on_error=None):
+    """
+    Call read() until it succeeds, sleeping backoff, 2 * backoff, ... between attempts.
+    :param sensor: Sensor name used in the metrics labels and log lines.
+    :param on_error: Called after each failed attempt, e.g. to re-initialize the sensor.
+    :return: The result of read(); the last error is raised once every attempt has failed.
+    """
+    started = time.perf_counter()
+    for attempt in range(attempts):
+        try:
+            result = read()
+        except Exception as e:
+            read_errors.inc(sensor=sensor, error=_error_kind(e))
+            if on_error is not None:
+                on_error()
+            if attempt == attempts - 1:
+                read_failures.inc(sensor=sensor)
+                raise
+            sensor_logger.warning(f"{sensor} read failed ({e}), retry {attempt + 1} of {attempts - 1}")
+            time.sleep(backoff * 2 ** attempt)
+        else:
+            read_latency.observe(time.perf_counter() - started, sensor=sensor)
+            return result
+
 # Function to convert raw ADC value to soil moisture percentage
 def convert_to_percentage(raw_value, dry_value=DRY_SOIL_ADC, wet_value=WET_SOIL_ADC):
     if raw_value >= dry_value:
@@ -41,90 +115,338 @@ def convert_to_percentage(raw_value, dry_value=DRY_SOIL_ADC, wet_value=WET_SOIL_
     percentage = ((dry_value - raw_value) / (dry_value - wet_value)) * 100
     return round(percentage, 2)
 
+def load_soil_calibration(path=CALIBRATION_FILE):
+    """
+    Load the per-channel calibration table.
+    :return: Dict of channel number to (dry, wet) raw ADC values; empty if there is no file.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            channels = json.load(f)["channels"]
+        return {int(channel): (values["dry"], values["wet"]) for channel, values in channels.items()}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        sensor_logger.error(f"Error loading soil calibration from {path}: {e}")
+        return {}
+
+def save_soil_calibration(table, path=CALIBRATION_FILE):
+    """Write a calibration table of channel -> (dry, wet) and use it for later reads."""
+    global soil_calibration
+    channels = {str(channel): {"dry": dry, "wet": wet} for channel, (dry, wet) in sorted(table.items())}
+    with open(path, "w") as f:
+        json.dump({"channels": channels}, f, indent=2)
+    soil_calibration = dict(table)
+
+def get_calibration(channel):
+    """Return (dry, wet) raw ADC values for a channel."""
+    global soil_calibration
+    if soil_calibration is None:
+        soil_calibration = load_soil_calibration()
+    return soil_calibration.get(channel, (DRY_SOIL_ADC, WET_SOIL_ADC))
+
+def configured_soil_channels():
+    """Channels listed in the calibration file."""
+    global soil_calibration
+    if soil_calibration is None:
+        soil_calibration = load_soil_calibration()
+    return sorted(soil_calibration)
+
 # Function to read soil moisture from ADC
 def read_soil_moisture(channel, adc_address=ADC_ADDRESS):
-    bus = SMBus(1)
     assert 0 <= channel <= 7, "Invalid ADC channel. Must be between 0 and 7."
     command = 0x84 | (channel << 4)
-    bus.write_byte(adc_address, command)
-    raw_value = bus.read_byte(adc_address)
-    #sensor_logger.info(f"Read soil moisture from channel {channel}: raw ADC value = {raw_value}")
-    return convert_to_percentage(raw_value)
+    with bus_session() as bus:
+        bus.write_byte(adc_address, command)
+        raw_value = bus.read_byte(adc_address)
+    sensor_logger.debug(f"Read soil moisture from channel {channel}: raw ADC value = {raw_value}")
+    return convert_to_percentage(raw_value, *get_calibration(channel))
+
+def filter_samples(samples, method=SOIL_FILTER, trim_fraction=TRIM_FRACTION):
+    """
+    Reduce a burst of readings to one value, rejecting outliers.
+    :param method: 'median', 'trimmed' (mean without the lowest and highest trim_fraction) or 'mean'.
+    :return: (value, variance); for median and trimmed the variance is taken over the
+             trimmed samples so a single spike does not inflate it.
+    """
+    ordered = sorted(samples)
+    trim = int(len(ordered) * trim_fraction) if method != "mean" else 0
+    kept = ordered[trim:len(ordered) - trim] or ordered
+    if method == "median":
+        value = statistics.median(ordered)
+    elif method in ("trimmed", "mean"):
+        value = statistics.fmean(kept)
+    else:
+        raise ValueError(f"Unknown filter: {method}")
+    variance = statistics.pvariance(kept) if len(kept) > 1 else 0.0
+    return round(value, 2), round(variance, 4)
+
+# Function to read raw bursts from several ADC channels in one bus session
+def read_soil_raw(channels, samples=SOIL_SAMPLES, delay=SOIL_SAMPLE_DELAY, adc_address=ADC_ADDRESS):
+    """
+    Take `samples` back-to-back conversions of each channel while holding the bus once.
+    :return: Dict of channel -> list of raw ADC values (0-255).
+    """
+    if samples < 1:
+        raise ValueError(f"Soil bursts need at least one sample, got {samples}")
+    def scan():
+        raw_values = {}
+        with bus_session() as bus:
+            for channel in channels:
+                assert 0 <= channel <= 7, "Invalid ADC channel. Must be between 0 and 7."
+                bus.write_byte(adc_address, 0x84 | (channel << 4))
+                burst = raw_values[channel] = []
+                for i in range(samples):
+                    if i and delay:
+                        time.sleep(delay)
+                    burst.append(bus.read_byte(adc_address))  # Each read returns a new conversion
+        return raw_values
+
+    return with_retries("ads7830", scan)
+
+def scan_soil_channels(channels=None, samples=SOIL_SAMPLES, delay=SOIL_SAMPLE_DELAY, method=SOIL_FILTER,
+                       adc_address=ADC_ADDRESS):
+    """
+    Read several soil probes in one pass, each converted with its own calibration.
+    :param channels: ADC channels to scan; defaults to the channels in the calibration file.
+    :return: Dict of channel -> (soil moisture percentage, variance in %^2)
+    """
+    if channels is None:
+        channels = configured_soil_channels() or [0]
+    results = {}
+    for channel, burst in read_soil_raw(channels, samples, delay, adc_address).items():
+        dry, wet = get_calibration(channel)
+        results[channel] = filter_samples([convert_to_percentage(raw, dry, wet) for raw in burst], method)
+    return results
+
+# Function to read a burst of soil moisture samples from one channel
+def read_soil_moisture_burst(channel, samples=SOIL_SAMPLES, delay=SOIL_SAMPLE_DELAY, method=SOIL_FILTER,
+                             adc_address=ADC_ADDRESS):
+    """
+    Take `samples` back-to-back conversions of one ADC channel and filter them.
+    :return: (soil moisture percentage, variance in %^2)
+    """
+    return scan_soil_channels([channel], samples, delay, method, adc_address)[channel]
 
 # Function to read Raspberry Pi CPU temperature
 def get_cpu_temperature():
     try:
-        with open("/sys/class/thermal/thermal_zone0/temp", "r") as temp_file:
-            temp = int(temp_file.read()) / 1000.0  # Convert to Celsius
-        #sensor_logger.info(f"CPU temperature: {temp}°C")
+        with read_latency.time(sensor="cpu"):
+            with open("/sys/class/thermal/thermal_zone0/temp", "r") as temp_file:
+                temp = int(temp_file.read()) / 1000.0  # Convert to Celsius
+        sensor_logger.debug(f"CPU temperature: {temp}°C")
         return temp
     except Exception as e:
+        read_errors.inc(sensor="cpu", error=_error_kind(e))
         sensor_logger.error(f"Error reading CPU temperature: {e}")
         return None
     
+def _convert_sht31(data):
+    for offset, word in ((0, "temperature"), (3, "humidity")):
+        if sht31_crc(data[offset:offset + 2]) != data[offset + 2]:
+            raise SensorCRCError(f"SHT31 {word} CRC mismatch")
+    temp_raw = (data[0] << 8) | data[1]
+    humidity_raw = (data[3] << 8) | data[4]
+    temp = round(-45 + 175 * (temp_raw / 65535.0), 2)
+    humidity = round(100 * (humidity_raw / 65535.0), 2)
+    return temp, humidity
+
+def _read_sht31_single():
+    with bus_session() as bus:
+        bus.write_i2c_block_data(SHT31_ADDRESS, SINGLE_SHOT_COMMAND[0], [SINGLE_SHOT_COMMAND[1]])
+    time.sleep(SHT31_CONVERSION_TIME)
+    with bus_session() as bus:
+        data = bus.read_i2c_block_data(SHT31_ADDRESS, 0x00, 6)
+    return _convert_sht31(data)
+
 # Function to read temperature and humidity from SHT31 sensor
 def read_temperature_humidity():
     try:
-        bus = SMBus(1)
-        bus.write_i2c_block_data(SHT31_ADDRESS, TEMP_COMMAND[0], [TEMP_COMMAND[1]])
-        time.sleep(0.015)
-        data = bus.read_i2c_block_data(SHT31_ADDRESS, 0x00, 6)
-        temp_raw = (data[0] << 8) | data[1]
-        humidity_raw = (data[3] << 8) | data[4]
-        temp = round(-45 + 175 * (temp_raw / 65535.0), 2)
-        humidity = round(100 * (humidity_raw / 65535.0), 2)
-        #sensor_logger.info(f"Temperature: {temp}°C, Humidity: {humidity}%")
-        return temp, humidity
+        return with_retries("sht31", _read_sht31_single)
     except Exception as e:
         sensor_logger.error(f"Error reading temperature and humidity: {e}")
         return None, None
-    
-def get_light_status(path=status_file_path):
-        """Get the current light status from the file."""
-        if os.path.exists(path):
-            with open(path, "r") as status_file:
-                light_status = status_file.read().strip()
-            #sensor_logger.info(f"Returning light status from file at {path}: {light_status}")
-            return light_status
-        else:
-            #sensor_logger.info(f"Status file not found at {path}. Returning default status: OFF.")
-            return "OFF"
+
+# Split-phase SHT31 read: start the conversion, do other work, then collect it
+def start_sht31_measurement():
+    """
+    Start a single-shot SHT31 conversion without holding the bus while it runs.
+    :return: time.monotonic() at which the result is ready, or None on error.
+    """
+    try:
+        with bus_session() as bus:
+            bus.write_i2c_block_data(SHT31_ADDRESS, SINGLE_SHOT_COMMAND[0], [SINGLE_SHOT_COMMAND[1]])
+        return time.monotonic() + SHT31_CONVERSION_TIME
+    except Exception as e:
+        read_errors.inc(sensor="sht31", error=_error_kind(e))
+        sensor_logger.warning(f"Error starting temperature and humidity measurement: {e}")
+        return None
+
+def collect_sht31_measurement(ready_at):
+    """
+    Read the result of start_sht31_measurement, waiting only for whatever
+    part of the conversion time has not already passed. If the start or the
+    read failed, falls back to read_temperature_humidity and its retries.
+    :return: (temperature, humidity), or (None, None) on error.
+    """
+    if ready_at is None:
+        return read_temperature_humidity()
+    # The conversion overlaps other reads, so only the wait and the read count as latency
+    started = time.monotonic()
+    try:
+        remaining = ready_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        with bus_session() as bus:
+            data = bus.read_i2c_block_data(SHT31_ADDRESS, 0x00, 6)
+        result = _convert_sht31(data)
+    except Exception as e:
+        read_errors.inc(sensor="sht31", error=_error_kind(e))
+        sensor_logger.warning(f"Error collecting temperature and humidity: {e}")
+        return read_temperature_humidity()
+    read_latency.observe(time.monotonic() - started, sensor="sht31")
+    return result
+
+def start_sht31_periodic(measurements_per_second=1):
+    """Put the SHT31 in periodic acquisition mode; results are then read with fetch_sht31_periodic."""
+    command = PERIODIC_COMMANDS[measurements_per_second]
+    with bus_session() as bus:
+        bus.write_i2c_block_data(SHT31_ADDRESS, command[0], [command[1]])
+
+def _fetch_sht31_once():
+    with bus_session() as bus:
+        bus.write_i2c_block_data(SHT31_ADDRESS, FETCH_COMMAND[0], [FETCH_COMMAND[1]])
+        data = bus.read_i2c_block_data(SHT31_ADDRESS, 0x00, 6)
+    return _convert_sht31(data)
+
+def fetch_sht31_periodic():
+    """
+    Read the latest periodic SHT31 measurement; no conversion wait is needed.
+    :return: (temperature, humidity), or (None, None) on error.
+    """
+    try:
+        return with_retries("sht31", _fetch_sht31_once)
+    except Exception as e:
+        sensor_logger.error(f"Error fetching periodic temperature and humidity: {e}")
+        return None, None
+
+def stop_sht31_periodic():
+    """Return the SHT31 to single-shot mode."""
+    try:
+        with bus_session() as bus:
+            bus.write_i2c_block_data(SHT31_ADDRESS, BREAK_COMMAND[0], [BREAK_COMMAND[1]])
+    except Exception as e:
+        sensor_logger.error(f"Error stopping periodic temperature and humidity measurement: {e}")
+
+def get_light_status():
+    """Get the current light status published by light_control."""
+    return get_registry().get_state("light", "OFF")
 
 # Function to initialize the VEML7700 sensor
 def initialize_veml7700():
-    global veml7700
+    global veml7700, lux_range
     try:
         if veml7700 is not None:
-            #sensor_logger.info("VEML7700 is already initialized.")
+            sensor_logger.debug("VEML7700 is already initialized.")
             return veml7700
 
-        i2c = board.I2C()  # Uses board.SCL and board.SDA
-        veml7700 = adafruit_veml7700.VEML7700(i2c)
-        
-        veml7700.light_gain = veml7700.ALS_GAIN_1_8  # Try changing the gain value
-        veml7700.integration_time = 100  # Try increasing the integration time to 100ms
-        
-        #sensor_logger.info("VEML7700 sensor initialized successfully.")
+        if os.environ.get(FAKE_BUS_ENV) == "1":
+            veml7700 = FakeVEML7700()
+        else:
+            # Imported here so the rest of the sensor layer works without Blinka
+            import board
+            import adafruit_veml7700
+
+            i2c = board.I2C()  # Uses board.SCL and board.SDA
+            veml7700 = adafruit_veml7700.VEML7700(i2c)
+
+        lux_range = None  # Gain and integration time are set before the first read
+        sensor_logger.debug("VEML7700 sensor initialized successfully.")
         return veml7700
     except Exception as e:
         sensor_logger.error(f"Error initializing VEML7700 sensor: {e}")
         return None
 
-def read_lux():
+def _reset_veml7700():
+    """Drop the VEML7700 handle so the next read initializes it again."""
     global veml7700
-    try:
-        if veml7700 is None:
-            veml7700 = initialize_veml7700()
-
-        if veml7700:
-            raw_light = veml7700.lux  # Raw lux value for ambient light
-            #sensor_logger.info(f"Raw light reading: {raw_light}")
-            ambient_light = round(raw_light, 2)  # Processed lux value
-            #sensor_logger.info(f"Processed ambient light reading: {ambient_light} lux")
-            return ambient_light
+    veml7700 = None
+
+def _lux_resolution(step):
+    _, gain, _, integration_ms = LUX_RANGES[step]
+    return LUX_MAX_RESOLUTION * (800 / integration_ms) * (2 / gain)
+
+def _counts_to_lux(counts, step):
+    return counts * _lux_resolution(step)
+
+def choose_lux_range(lux):
+    """Pick the least sensitive, and so fastest, setting expected to give LUX_TARGET_COUNTS at this lux."""
+    for step in range(len(LUX_RANGES)):
+        if lux / _lux_resolution(step) >= LUX_TARGET_COUNTS:
+            return step
+    return len(LUX_RANGES) - 1
+
+def _apply_lux_range(sensor, step):
+    """Set gain and integration time; a reading is valid one integration time later."""
+    global lux_range, lux_ready_at
+    if step == lux_range:
+        return
+    gain_name, _, integration_name, integration_ms = LUX_RANGES[step]
+    sensor.light_gain = getattr(sensor, gain_name)
+    sensor.light_integration_time = getattr(sensor, integration_name)
+    lux_range = step
+    lux_ready_at = time.monotonic() + integration_ms * 1.1 / 1000
+
+def _read_lux_counts(sensor, step):
+    _apply_lux_range(sensor, step)
+    remaining = lux_ready_at - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+    return sensor.light  # Raw ALS count
+
+def _read_lux_once(auto_range):
+    sensor = initialize_veml7700()
+    if sensor is None:
+        raise OSError("VEML7700 sensor is not initialized")
+    step = lux_range if auto_range and lux_range is not None else LUX_FIXED_RANGE
+    counts = _read_lux_counts(sensor, step)
+    for _ in range(LUX_MAX_RERANGES if auto_range else 0):
+        # Re-take readings that saturated or are too coarse at the current setting
+        if counts > LUX_MAX_COUNTS and step > 0:
+            step = min(choose_lux_range(_counts_to_lux(counts, step)), step - 1)
+        elif counts < LUX_MIN_COUNTS and step < len(LUX_RANGES) - 1:
+            step = max(choose_lux_range(_counts_to_lux(counts, step)), step + 1)
         else:
-            sensor_logger.error("VEML7700 sensor is not initialized.")
-            return None
+            break
+        counts = _read_lux_counts(sensor, step)
+
+    lux = _counts_to_lux(counts, step)
+    _, gain, _, integration_ms = LUX_RANGES[step]
+    if auto_range:
+        # Switch now so the settings for the next sample have settled by then
+        _apply_lux_range(sensor, choose_lux_range(lux))
+    # Still above the linear range at the least sensitive setting (or with auto-ranging off):
+    # the sensor under-reads there, up to full scale at 65535 counts
+    saturated = counts > LUX_MAX_COUNTS
+    if saturated:
+        sensor_logger.warning(f"VEML7700 count {counts} is above the linear range at gain {gain} and "
+                              f"{integration_ms} ms; {lux:.0f} lx is a lower bound.")
+    return {'lux': round(lux, 2), 'gain': gain, 'integration_ms': integration_ms, 'counts': counts,
+            'saturated': saturated}
+
+def read_lux_sample(auto_range=True):
+    """
+    Read the ambient light, auto-ranging gain and integration time from the previous reading.
+    :param auto_range: False keeps the fixed gain 1/8 and 100 ms integration.
+    :return: Dict with 'lux' and the 'gain', 'integration_ms' and raw 'counts' used, and 'saturated',
+             True when the count is above the linear range so 'lux' is only a lower bound; None on error.
+    """
+    try:
+        return with_retries("veml7700", lambda: _read_lux_once(auto_range), on_error=_reset_veml7700)
     except Exception as e:
         sensor_logger.error(f"Error reading ambient light: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def read_lux(auto_range=True):
+    sample = read_lux_sample(auto_range)
+    return None if sample is None else sample['lux']
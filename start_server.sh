@@ -3,6 +3,14 @@
 # Create a logs directory if it doesn't exist
 mkdir -p logs
 
+# Check if sensor_service.py is already running
+if ! pgrep -f "python3 sensor_service.py" > /dev/null; then
+    echo "Starting sensor_service.py..."
+    sudo python3 sensor_service.py > logs/sensor_service.log 2>&1 &
+else
+    echo "sensor_service.py is already running."
+fi
+
 # Check if data_update.py is already running
 if ! pgrep -f "python3 data_update.py" > /dev/null; then
     echo "Starting data_update.py..."
@@ -0,0 +1,150 @@
+import os
+import time
+import mmap
+import fcntl
+import struct
+import threading
+
+# Shared-memory file holding one fixed-size slot per published device/daemon
+REGISTRY_PATH = "/dev/shm/pigarden_state" if os.path.isdir("/dev/shm") else "/tmp/pigarden_state"
+MAX_SLOTS = 32
+HEARTBEAT_INTERVAL = 5  # How often daemons refresh their heartbeat (in seconds)
+HEARTBEAT_TIMEOUT = 20  # A daemon without a heartbeat for this long counts as stopped (in seconds)
+
+# Slot layout: seqlock counter, name, state, heartbeat, last change, pid
+FIELD_SIZE = 24  # Longest name or state, in UTF-8 bytes
+SLOT_FORMAT = f"<I{FIELD_SIZE}s{FIELD_SIZE}sddi4x"
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)  # 72 bytes
+
+
+def _encode(value, what):
+    """UTF-8 bytes of a name or state, which must fit its slot field unabridged."""
+    encoded = value.encode()
+    if len(encoded) > FIELD_SIZE:
+        raise ValueError(f"{what} {value!r} is longer than {FIELD_SIZE} bytes")
+    return encoded
+
+
+class StateRegistry:
+    """
+    Cross-process registry of named states backed by an mmap'ed file.
+    Each writer updates its slot under a seqlock (the counter is odd while a
+    write is in progress), so readers never take a lock or make a syscall:
+    a read is a few struct unpacks from shared memory. Writers within one
+    process are serialized by a lock.
+    """
+
+    def __init__(self, path=REGISTRY_PATH, max_slots=MAX_SLOTS):
+        self.path = path
+        self.max_slots = max_slots
+        size = SLOT_SIZE * max_slots
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.mm = mmap.mmap(self.fd, size)
+        self.slots = {}  # name -> slot index, cached after the first lookup
+        self.lock = threading.Lock()
+
+    def _find(self, name):
+        index = self.slots.get(name)
+        if index is not None:
+            return index
+        encoded = _encode(name, "Name")
+        for index in range(self.max_slots):
+            slot_name = self.mm[index * SLOT_SIZE + 4:index * SLOT_SIZE + 28].rstrip(b"\0")
+            if slot_name == encoded:
+                self.slots[name] = index
+                return index
+        return None
+
+    def _claim(self, name):
+        """Find or allocate the slot for name; allocation is serialized with flock."""
+        index = self._find(name)
+        if index is not None:
+            return index
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            index = self._find(name)
+            if index is not None:
+                return index
+            for index in range(self.max_slots):
+                if self.mm[index * SLOT_SIZE + 4] == 0:
+                    struct.pack_into(SLOT_FORMAT, self.mm, index * SLOT_SIZE, 0, _encode(name, "Name"), b"", 0.0, 0.0, 0)
+                    self.slots[name] = index
+                    return index
+            raise RuntimeError(f"State registry {self.path} is full ({self.max_slots} slots)")
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _read_slot(self, index):
+        offset = index * SLOT_SIZE
+        while True:
+            fields = struct.unpack_from(SLOT_FORMAT, self.mm, offset)
+            if fields[0] % 2 == 0 and struct.unpack_from("<I", self.mm, offset)[0] == fields[0]:
+                return fields
+            time.sleep(0)  # A writer is mid-update; let it finish
+
+    def _write_slot(self, index, state, heartbeat, last_change):
+        offset = index * SLOT_SIZE
+        seq, name = struct.unpack_from("<I24s", self.mm, offset)
+        struct.pack_into("<I", self.mm, offset, (seq + 1) & 0xFFFFFFFF)
+        struct.pack_into(SLOT_FORMAT, self.mm, offset, (seq + 1) & 0xFFFFFFFF, name, state,
+                         heartbeat, last_change, os.getpid())
+        struct.pack_into("<I", self.mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def publish(self, name, state):
+        """
+        Set the state of name; last_change is only updated when the state differs.
+        :raises ValueError: If name or state is longer than FIELD_SIZE bytes in UTF-8.
+        """
+        encoded = _encode(state, "State")
+        with self.lock:
+            index = self._claim(name)
+            now = time.time()
+            _, _, old_state, _, last_change, _ = self._read_slot(index)
+            if old_state.rstrip(b"\0") != encoded or last_change == 0.0:
+                last_change = now
+            self._write_slot(index, encoded, now, last_change)
+
+    def heartbeat(self, name):
+        """Refresh the heartbeat of name without changing its state."""
+        with self.lock:
+            index = self._claim(name)
+            _, _, state, _, last_change, _ = self._read_slot(index)
+            self._write_slot(index, state.rstrip(b"\0"), time.time(), last_change)
+
+    def read(self, name):
+        """
+        Return a dict with 'state', 'heartbeat', 'last_change' and 'pid' for name,
+        or None if nothing was published under it.
+        """
+        index = self._find(name)
+        if index is None:
+            return None
+        _, _, state, heartbeat, last_change, pid = self._read_slot(index)
+        return {
+            'state': state.rstrip(b"\0").decode(),
+            'heartbeat': heartbeat,
+            'last_change': last_change,
+            'pid': pid,
+        }
+
+    def get_state(self, name, default=None):
+        entry = self.read(name)
+        return default if entry is None or not entry['state'] else entry['state']
+
+    def is_alive(self, name, timeout=HEARTBEAT_TIMEOUT):
+        """True if name has sent a heartbeat within the last `timeout` seconds."""
+        entry = self.read(name)
+        return entry is not None and time.time() - entry['heartbeat'] < timeout
+
+
+_registry = None
+
+
+def get_registry():
+    """Return this process's shared StateRegistry, opening it on first use."""
+    global _registry
+    if _registry is None:
+        _registry = StateRegistry()
+    return _registry
@@ -13,5 +13,8 @@ pkill -f light_control.py
 echo "Stopping irrigation_system.py..."
 pkill -f irrigation_system.py
 
+echo "Stopping sensor_service.py..."
+pkill -f sensor_service.py
+
 # Confirm processes are killed
 echo "All specified scripts have been stopped."
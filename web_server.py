@@ -1,11 +1,21 @@
 import eventlet
 import socketio
-from flask import Flask, render_template
-from data_storage import get_data_from_db
-from sensor_utils import get_cpu_temperature, read_soil_moisture, read_temperature_humidity, read_lux
+from flask import Flask, Response, abort, g, render_template, request
+from data_storage import get_chart_series, get_latest_row, parse_timestamp, CHART_POINTS, DB_PATH, DOWNSAMPLERS, MAX_POINTS, TIMESTAMP_FORMAT
+from export import export, FORMATS
+from rollups import METRICS
+from replication import load_hub_config
+from collector import Collector, IngestError, bearer_token
+from sensor_client import get_snapshot
 from sensor_utils import get_light_status
-import psutil
+from state_registry import get_registry
+import metrics
+import os
 import ssl
+import gzip
+import json
+import pytz
+from datetime import datetime
 import logging
 import time  # For delay during restart
 
@@ -21,82 +31,248 @@ sio = socketio.Server(cors_allowed_origins="*")
 app = Flask(__name__)
 flask_app = socketio.WSGIApp(sio, app)
 
-# Sensor and ADC configuration
-ADC_CHANNEL = 0
+# Ignore sensor snapshots older than this (in seconds)
+SNAPSHOT_MAX_AGE = 30
+BROADCAST_INTERVAL = 10  # Interval between broadcast checks (in seconds)
+GZIP_LEVEL = 6  # Compression level for JSON API responses
+GZIP_MIN_SIZE = 512  # Smaller JSON bodies are sent uncompressed (in bytes)
 
-def is_process_running(process_name):
-    for process in psutil.process_iter(attrs=['pid', 'name', 'cmdline']):
-        try:
-            if process_name in " ".join(process.info['cmdline']):
-                return True
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-    return False
+# TLS and port settings can be overridden in web_server.json:
+# {"port": 443, "certfile": "/path/fullchain.pem", "keyfile": "/path/privkey.pem"}
+SERVER_FILE = "web_server.json"
+DEFAULT_SERVER = {
+    "port": 443,
+    "certfile": "/etc/letsencrypt/live/pioasis.duckdns.org/fullchain.pem",
+    "keyfile": "/etc/letsencrypt/live/pioasis.duckdns.org/privkey.pem",
+}
+
+def load_server_config(path=SERVER_FILE):
+    """Return DEFAULT_SERVER updated with the settings in path, if it exists."""
+    config = dict(DEFAULT_SERVER)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            config.update(json.load(f))
+    return config
+
+# With a "collector" section in hub.json this server also collects readings from
+# other nodes, and every API takes ?node=<id> to serve that node's data
+collector = Collector.from_config(load_hub_config())
+
+# Last state sent to clients; deltas are computed against it
+last_broadcast = {}
+connected_clients = 0
+
+request_latency = metrics.histogram("pigarden_http_request_seconds", "Duration of HTTP requests until the response is returned, by endpoint")
+broadcast_latency = metrics.histogram("pigarden_broadcast_seconds", "Duration of emitting one status update to the dashboard clients")
+errors = metrics.counter("pigarden_errors_total", "Errors logged, by component")
+metrics.gauge("pigarden_socketio_clients", "Connected dashboard clients").set_function(lambda: connected_clients)
+
+def build_status():
+    """Collect the current dashboard status from the sensor service and local state."""
+    snapshot = get_snapshot(max_age=SNAPSHOT_MAX_AGE) or {}
+    return {
+        'soil_moisture': snapshot.get('soil_moisture'),
+        'temperature': snapshot.get('temperature'),
+        'humidity': snapshot.get('humidity'),
+        'cpu_temperature': snapshot.get('cpu_temperature'),
+        'lux': snapshot.get('lux'),
+        'light_status': get_light_status(),
+        'irrigation_system_status': get_registry().is_alive("irrigation_system"),
+    }
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    # Streamed responses are timed until their first chunk is ready
+    request_latency.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or "unknown")
+    return response
 
 @app.route("/")
 def index():
-    timestamps, temperatures, humidities, soil_moistures, cpu_temperatures, lux_values = get_data_from_db()
-    return render_template(
-        "index.html",
-        timestamps=timestamps,
-        temperatures=temperatures,
-        humidities=humidities,
-        soil_moistures=soil_moistures,
-        cpu_temperatures=cpu_temperatures,
-        lux_values=lux_values
-    )
+    # Static shell; the charts load their data from /api/history
+    return render_template("index.html")
+
+def conditional_json(latest, build_payload):
+    """
+    Build a JSON response versioned by the newest row. Clients that already hold
+    that version get a 304 without the payload being built; others get compact,
+    gzip-compressed JSON when they accept it.
+    :param latest: Newest row from get_latest_row, or None for an empty table.
+    :param build_payload: Callable returning the JSON-serializable payload.
+    """
+    etag = str(latest['id']) if latest else "empty"
+    last_modified = None
+    if latest:
+        local_time = datetime.strptime(latest['timestamp'], TIMESTAMP_FORMAT)
+        last_modified = pytz.timezone("Europe/Warsaw").localize(local_time).astimezone(pytz.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = (last_modified is not None and request.if_modified_since is not None
+                        and last_modified <= request.if_modified_since)
+
+    if not_modified:
+        response = Response(status=304)
+    else:
+        body = json.dumps(build_payload(), separators=(",", ":")).encode()
+        response = Response(body, mimetype="application/json")
+        if len(body) >= GZIP_MIN_SIZE and "gzip" in request.accept_encodings:
+            response.set_data(gzip.compress(body, GZIP_LEVEL))
+            response.headers["Content-Encoding"] = "gzip"
+
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "no-cache"  # Always revalidate, usually with a 304
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def request_db_path():
+    """Database the request reads: the local one, or on a hub with ?node=<id>, that node's."""
+    node = request.args.get("node")
+    if node is None:
+        return DB_PATH
+    if collector is None or node not in collector.nodes():
+        abort(404)
+    return collector.db_path(node)
+
+@app.route("/api/latest")
+def api_latest():
+    latest = get_latest_row(db_path=request_db_path())
+    return conditional_json(latest, lambda: latest)
+
+@app.route("/api/history")
+def api_history():
+    # Optional ?start=...&end=... window, as 'YYYY-MM-DD HH:MM:SS', ?points=<n> per chart
+    # and ?method=lttb|minmax; without a window the newest ?limit=<n> rows are used.
+    # points and limit are clamped to 1..MAX_POINTS
+    method = request.args.get("method", "lttb")
+    if method not in DOWNSAMPLERS:
+        return Response(json.dumps({"error": f"Unknown method: {method}"}), status=400, mimetype="application/json")
+    try:
+        start, end = (parse_timestamp(request.args[name]) if name in request.args else None
+                      for name in ("start", "end"))
+    except ValueError as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+    points = min(max(request.args.get("points", CHART_POINTS, type=int), 1), MAX_POINTS)
+    limit = min(max(request.args.get("limit", 24, type=int), 1), MAX_POINTS)
+    db_path = request_db_path()
+    return conditional_json(get_latest_row(db_path=db_path), lambda: get_chart_series(
+        start=start,
+        end=end,
+        points=points,
+        limit=limit,
+        method=method,
+        db_path=db_path,
+    ))
+
+@app.route("/api/nodes")
+def api_nodes():
+    # Nodes known to this hub, each with its newest reading
+    if collector is None:
+        abort(404)
+    nodes = [{'node': node, 'latest': get_latest_row(db_path=collector.db_path(node))} for node in collector.nodes()]
+    return Response(json.dumps(nodes), mimetype="application/json")
+
+@app.route("/api/ingest", methods=["POST"])
+def api_ingest():
+    # Pushes from replication.py on other nodes
+    if collector is None:
+        abort(404)
+    try:
+        result = collector.ingest(bearer_token(request.headers.get("Authorization")),
+                                  request.get_data(), request.headers.get("Content-Encoding"))
+    except IngestError as e:
+        return Response(json.dumps({"error": str(e)}), status=e.status, mimetype="application/json")
+    return Response(json.dumps(result), mimetype="application/json")
+
+def cooperative(stream):
+    """Pass a byte stream through, letting the eventlet hub serve other clients between chunks."""
+    for data in stream:
+        yield data
+        eventlet.sleep(0)
+
+@app.route("/api/export")
+def api_export():
+    # ?format=csv|ndjson|parquet, optional ?start=...&end=... window and ?metrics=a,b;
+    # the response is streamed with chunked transfer encoding
+    fmt = request.args.get("format", "csv")
+    metric_names = request.args.get("metrics")
+    try:
+        stream = export(fmt, request.args.get("start"), request.args.get("end"),
+                        metric_names.split(",") if metric_names else METRICS, db_path=request_db_path())
+    except (ValueError, RuntimeError) as e:
+        return Response(json.dumps({"error": str(e)}), status=400, mimetype="application/json")
+    logging.info(f"Exporting readings as {fmt}: {request.query_string.decode()}")
+    return Response(cooperative(stream), mimetype=FORMATS[fmt],
+                    headers={"Content-Disposition": f"attachment; filename=sensor_readings.{fmt}"})
 
 @sio.event
 def connect(sid, environ):
+    global connected_clients, last_broadcast
+    connected_clients += 1
     logging.info(f"Client connected: {sid}")
     sio.emit('newclientconnect', {'description': 'Welcome to the dashboard!'}, room=sid)
+    # New clients get the full state once; after that they only receive deltas.
+    # The other clients are brought up to the same state, so the next delta fits everyone
+    try:
+        status = build_status()
+        delta = changed_fields(status)
+        with broadcast_latency.time():
+            if delta:
+                sio.emit('delta', delta, skip_sid=sid)
+            sio.emit('broadcast', status, room=sid)
+        last_broadcast = status
+    except Exception as e:
+        errors.inc(component="web_server")
+        logging.error(f"Error sending initial status to {sid}: {e}")
 
 @sio.event
 def disconnect(sid):
+    global connected_clients
+    connected_clients -= 1
     logging.info(f"Client disconnected: {sid}")
 
+def changed_fields(status):
+    """Fields of status that differ from last_broadcast."""
+    return {key: value for key, value in status.items()
+            if key not in last_broadcast or last_broadcast[key] != value}
+
 def broadcast_data():
+    """Emit only the fields that changed since the last broadcast."""
+    global last_broadcast
     while True:
         try:
-            soil_moisture = read_soil_moisture(ADC_CHANNEL)
-            temperature, humidity = read_temperature_humidity()
-            cpu_temperature = get_cpu_temperature()
-            ambient_light = read_lux()
-            light_status = get_light_status()
-            irrigation_system_status = is_process_running("irrigation_system.py")
-
-            sio.emit('broadcast', {
-                'soil_moisture': soil_moisture,
-                'temperature': temperature,
-                'humidity': humidity,
-                'cpu_temperature': cpu_temperature,
-                'lux': ambient_light,
-                'light_status': light_status,
-                'irrigation_system_status': irrigation_system_status
-            })
+            if connected_clients > 0:
+                status = build_status()
+                delta = changed_fields(status)
+                if delta:
+                    with broadcast_latency.time():
+                        sio.emit('delta', delta)
+                last_broadcast = status
         except Exception as e:
+            errors.inc(component="web_server")
             logging.error(f"Error during data broadcast: {e}")
 
-        eventlet.sleep(10)
+        eventlet.sleep(BROADCAST_INTERVAL)
 
 # Function to start the WSGI server
 def start_server():
     logging.info("Web server starting...")
 
+    config = load_server_config()
+
     # Load SSL certificates
     context = ssl.SSLContext(ssl.PROTOCOL_TLS)
-    context.load_cert_chain(
-        certfile='/etc/letsencrypt/live/pioasis.duckdns.org/fullchain.pem',
-        keyfile='/etc/letsencrypt/live/pioasis.duckdns.org/privkey.pem'
-    )
+    context.load_cert_chain(certfile=config['certfile'], keyfile=config['keyfile'])
 
     # Start an HTTPS listener
-    https_listener = eventlet.listen(('', 443))
-    ssl_listener = eventlet.wrap_ssl(
-        https_listener,
-        certfile='/etc/letsencrypt/live/pioasis.duckdns.org/fullchain.pem',
-        keyfile='/etc/letsencrypt/live/pioasis.duckdns.org/privkey.pem'
-    )
+    https_listener = eventlet.listen(('', config['port']))
+    ssl_listener = eventlet.wrap_ssl(https_listener, certfile=config['certfile'], keyfile=config['keyfile'])
 
     # Spawn the data broadcasting process
     eventlet.spawn_n(broadcast_data)
@@ -106,10 +282,12 @@ def start_server():
 
 # Main execution loop to restart the server if it exits
 if __name__ == "__main__":
+    metrics.serve_metrics("web_server")
     while True:
         try:
             start_server()
         except Exception as e:
+            errors.inc(component="web_server")
             logging.error(f"Server exited unexpectedly: {e}")
             logging.info("Restarting the server in 5 seconds...")
             time.sleep(5)  # Delay before restarting